@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import tensorflow as tf
+
+from benchmarks.synthetic import (
+    make_deap_like,
+    make_dens_like,
+    write_deap_files,
+    write_dens_files
+)
+from datasets.data_loader import (
+    load_raw_dataset,
+    map_files,
+    read_deap_subject,
+    read_dens_file
+)
+from datasets.store import StoreWriter
+from feature_creation import (
+    FS,
+    NPERSEG,
+    NOVERLAP,
+    batched_spectrogram,
+    compute_features,
+    expand_labels,
+    sis_windows,
+    spectrogram_size,
+    split_indices
+)
+from inference import Predictor
+from model import build_model
+from pipeline import make_dataset
+
+
+STAGES = ["loading", "features", "split", "training", "inference"]
+
+
+# =====================================
+# Timing
+# =====================================
+
+def _best_of(func, repeat):
+    # The minimum is the least noisy estimate of the achievable time
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+# =====================================
+# Stages
+# =====================================
+
+def bench_loading(dens, deap, tmp_dir, repeat=3, num_workers=1):
+    """
+    Decoding of raw ``.mat`` / ``.dat`` files and reads from a converted store.
+    """
+    dens_eeg, dens_ratings = dens
+    deap_eeg, deap_ratings = deap
+
+    dens_paths = write_dens_files(dens_eeg, os.path.join(tmp_dir, "DENS"))
+    deap_paths = write_deap_files(deap_eeg, deap_ratings, os.path.join(tmp_dir, "DEAP"))
+
+    store_dir = os.path.join(tmp_dir, "store")
+    writer = StoreWriter("DENS", len(dens_eeg), store_dir)
+    writer.append(dens_eeg, ["synthetic"] * len(dens_eeg), [str(i) for i in range(len(dens_eeg))], dens_ratings)
+    writer.close()
+
+    return {
+        "load_dens_files_s": _best_of(
+            lambda: list(map_files(read_dens_file, dens_paths, num_workers)), repeat
+        ),
+        "load_deap_files_s": _best_of(
+            lambda: list(map_files(read_deap_subject, deap_paths, num_workers)), repeat
+        ),
+        "load_dens_store_s": _best_of(
+            lambda: np.array(load_raw_dataset("DENS", store_dir=store_dir)[0]), repeat
+        )
+    }
+
+
+def bench_features(dens_eeg, deap_eeg, repeat=3, chunk_size=32):
+    """
+    Spectrograms, the SIS window reshuffle and the full feature builds.
+    """
+    f_size, t_size = spectrogram_size(dens_eeg.shape[-1])
+    spec = np.empty(dens_eeg.shape[:2] + (f_size, t_size))
+    deap_spec = np.empty(deap_eeg.shape[:2] + spectrogram_size(deap_eeg.shape[-1]))
+
+    def reshuffle():
+        for start in range(0, len(spec), chunk_size):
+            sis_windows(spec[start:start + chunk_size], "float32")
+
+    batched_spectrogram(dens_eeg, spec, FS, NPERSEG, NOVERLAP)
+
+    return {
+        "spectrogram_dens_s": _best_of(
+            lambda: batched_spectrogram(dens_eeg, spec, FS, NPERSEG, NOVERLAP), repeat
+        ),
+        "spectrogram_deap_s": _best_of(
+            lambda: batched_spectrogram(deap_eeg, deap_spec, FS, NPERSEG, NOVERLAP), repeat
+        ),
+        "sis_reshuffle_s": _best_of(reshuffle, repeat),
+        "features_sis_s": _best_of(
+            lambda: compute_features(dens_eeg, "SIS", chunk_size=chunk_size), repeat
+        ),
+        "features_wsis_s": _best_of(
+            lambda: compute_features(dens_eeg, "WSIS", chunk_size=chunk_size), repeat
+        )
+    }
+
+
+def bench_split(X, repeat=3):
+    """
+    The 80/20 split and the gather of the training rows.
+    """
+    def split():
+        train_idx, _ = split_indices(len(X))
+        X[train_idx]
+
+    return {"split_s": _best_of(split, repeat)}
+
+
+def bench_training(X, y, num_classes, batch_size=256, steps=20):
+    """
+    Training throughput of build_model on the tf.data input pipeline.
+    """
+    model = build_model(X.shape[1:], num_classes)
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(),
+        loss=tf.keras.losses.sparse_categorical_crossentropy,
+        metrics=['accuracy']
+    )
+
+    indices = np.resize(np.arange(len(X)), steps * batch_size)
+    data = make_dataset(X, y, indices, batch_size=batch_size, shuffle=True)
+
+    # The first epoch pays for tracing and is not timed
+    model.fit(data, epochs=1, verbose=0)
+    seconds = _best_of(lambda: model.fit(data, epochs=1, verbose=0), 1)
+
+    return model, {
+        "train_steps_per_sec": steps / seconds,
+        "train_samples_per_sec": steps * batch_size / seconds
+    }
+
+
+def bench_inference(model, dens_eeg, X, tmp_dir, n_requests=50):
+    """
+    Single-trial latency and batched throughput of the Predictor.
+    """
+    checkpoint_path = os.path.join(tmp_dir, "model.h5")
+    model.save(checkpoint_path)
+
+    predictor = Predictor(checkpoint_path, feature_type="SIS")
+
+    latencies = []
+    for i in range(n_requests):
+        trial = dens_eeg[i % len(dens_eeg)][None]
+
+        start = time.perf_counter()
+        predictor.predict_trials(trial)
+        latencies.append(time.perf_counter() - start)
+
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+    seconds = _best_of(lambda: predictor.predict_features(X), 3)
+
+    return {
+        "inference_trial_p50_ms": float(p50),
+        "inference_trial_p95_ms": float(p95),
+        "inference_windows_per_sec": len(X) / seconds
+    }
+
+
+def run_benchmarks(stages=STAGES, dens_trials=32, dens_samples=1250, deap_subjects=2,
+                   deap_samples=8064, repeat=3, chunk_size=32, num_workers=1,
+                   train_steps=20, seed=0):
+    """
+    Runs the selected stages on synthetic DENS- and DEAP-like data.
+
+    Returns:
+        dict: ``meta`` (environment and sizes) and ``metrics`` ({name: value};
+        names ending in ``_s`` / ``_ms`` are times, ``_per_sec`` are rates)
+    """
+    dens = make_dens_like(dens_trials, dens_samples, seed)
+    deap = make_deap_like(deap_subjects, deap_samples, seed)
+
+    metrics = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        if "loading" in stages:
+            metrics.update(bench_loading(dens, deap, tmp_dir, repeat, num_workers))
+
+        if "features" in stages:
+            metrics.update(bench_features(dens[0], deap[0], repeat, chunk_size))
+
+        if {"split", "training", "inference"} & set(stages):
+            X = compute_features(dens[0], "SIS", chunk_size=chunk_size)
+            y = expand_labels(np.arange(dens_trials) % 2, "SIS")
+
+        if "split" in stages:
+            metrics.update(bench_split(X, repeat))
+
+        if {"training", "inference"} & set(stages):
+            model, train_metrics = bench_training(X, y, 2, steps=train_steps)
+
+            if "training" in stages:
+                metrics.update(train_metrics)
+
+        if "inference" in stages:
+            metrics.update(bench_inference(model, dens[0], X, tmp_dir))
+
+    meta = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "tensorflow": tf.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "dens_shape": list(dens[0].shape),
+        "deap_shape": list(deap[0].shape),
+        "repeat": repeat,
+        "chunk_size": chunk_size,
+        "num_workers": num_workers
+    }
+
+    return {"meta": meta, "metrics": metrics}
+
+
+# =====================================
+# Comparison
+# =====================================
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    Flags metrics that got worse than the baseline by more than ``tolerance``
+    (relative). Times regress when they grow, rates when they shrink.
+
+    Returns:
+        list: (name, baseline, current, relative change, regressed)
+    """
+    rows = []
+
+    for name, base_value in baseline["metrics"].items():
+        if name not in current["metrics"]:
+            continue
+
+        value = current["metrics"][name]
+        change = (value - base_value) / base_value
+
+        if name.endswith("_per_sec"):
+            regressed = change < -tolerance
+        else:
+            regressed = change > tolerance
+
+        rows.append((name, base_value, value, change, regressed))
+
+    return rows
+
+
+def _print_comparison(rows):
+    for name, base_value, value, change, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<28}{base_value:>12.4g}{value:>12.4g}{change:>+9.1%}  {flag}")
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline stages on synthetic EEG"
+    )
+
+    parser.add_argument('--output', default=os.path.join("benchmarks", "results.json"))
+    parser.add_argument('--baseline', help='Results JSON to compare against')
+    parser.add_argument('--current', help='Compare this results JSON instead of running the suite')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative slowdown flagged as a regression')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--dens_trials', type=int, default=32)
+    parser.add_argument('--dens_samples', type=int, default=1250)
+    parser.add_argument('--deap_subjects', type=int, default=2)
+    parser.add_argument('--deap_samples', type=int, default=8064)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--chunk_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--train_steps', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as file:
+            results = json.load(file)
+    else:
+        results = run_benchmarks(
+            stages=args.stages,
+            dens_trials=args.dens_trials,
+            dens_samples=args.dens_samples,
+            deap_subjects=args.deap_subjects,
+            deap_samples=args.deap_samples,
+            repeat=args.repeat,
+            chunk_size=args.chunk_size,
+            num_workers=args.num_workers,
+            train_steps=args.train_steps,
+            seed=args.seed
+        )
+
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+        for name, value in results["metrics"].items():
+            print(f"{name:<28}{value:>12.4g}")
+
+        print("Results saved to:", args.output)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        rows = compare(results, baseline, args.tolerance)
+        _print_comparison(rows)
+
+        if any(row[-1] for row in rows):
+            sys.exit(1)
@@ -0,0 +1,125 @@
+import os
+import pickle
+import numpy as np
+import scipy.io as sio
+
+from datasets.data_loader import map_labels
+from feature_creation import FS
+
+
+# =====================================
+# Synthetic EEG
+# =====================================
+
+def synthetic_eeg(n_trials, n_channels, n_samples, seed=0, dtype="float64"):
+    """
+    Random EEG-like signals of shape (trials, channels, samples).
+
+    Each channel is Gaussian background noise plus an alpha-band (8-12 Hz)
+    oscillation with random frequency, phase and amplitude, in microvolts.
+    Only the shapes and dtypes matter for timing, but realistic spectra keep
+    the features in a plausible range.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n_samples) / FS
+
+    eeg = rng.standard_normal((n_trials, n_channels, n_samples)) * 10.0
+
+    freq = rng.uniform(8, 12, size=(n_trials, n_channels, 1))
+    phase = rng.uniform(0, 2 * np.pi, size=(n_trials, n_channels, 1))
+    amplitude = rng.uniform(5, 20, size=(n_trials, n_channels, 1))
+
+    eeg += amplitude * np.sin(2 * np.pi * freq * t + phase)
+
+    return eeg.astype(dtype, copy=False)
+
+
+def synthetic_ratings(n_trials, seed=0):
+    """
+    Random (valence, arousal, dominance) self-assessments on the 1-9 scale.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(1, 9, size=(n_trials, 3))
+
+
+def make_dens_like(n_trials=32, n_samples=1250, seed=0):
+    """
+    DENS-like raw data as returned by load_raw_dataset: EEG of shape
+    (trials, 128, samples) in float64 and (trials, 3) ratings.
+    """
+    eeg = synthetic_eeg(n_trials, 128, n_samples, seed)
+    return eeg, synthetic_ratings(n_trials, seed)
+
+
+def make_deap_like(n_subjects=2, n_samples=8064, seed=0):
+    """
+    DEAP-like raw data as returned by load_raw_dataset: EEG of shape
+    (subjects * 40, 32, samples) in float64 and (subjects * 40, 3) ratings.
+    """
+    eeg = synthetic_eeg(n_subjects * 40, 32, n_samples, seed)
+    return eeg, synthetic_ratings(n_subjects * 40, seed)
+
+
+def synthetic_dataset(dataset_name, label_mapper, seed=0, **kwargs):
+    """
+    Synthetic stand-in for load_dataset: (eeg_data, labels) with the same
+    shapes and label layout as the real DENS or DEAP loader.
+    """
+    dataset_name = dataset_name.upper()
+
+    if dataset_name == "DENS":
+        eeg_data, ratings = make_dens_like(seed=seed, **kwargs)
+
+    elif dataset_name == "DEAP":
+        eeg_data, ratings = make_deap_like(seed=seed, **kwargs)
+
+    else:
+        raise ValueError(f"Unsupported dataset: {dataset_name}")
+
+    return eeg_data, map_labels(ratings, label_mapper, dataset_name)
+
+
+# =====================================
+# Raw File Writers
+# =====================================
+
+def write_dens_files(eeg, directory):
+    """
+    Writes each (128, samples) trial as a DENS-style ``.mat`` file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+
+    for i, trial in enumerate(eeg):
+        path = os.path.join(directory, f"sub{i:03d}_clip1.mat")
+        sio.savemat(path, {"eegData": trial})
+        paths.append(path)
+
+    return paths
+
+
+def write_deap_files(eeg, ratings, directory):
+    """
+    Writes DEAP-style ``sNN.dat`` pickles from (subjects * 40, 32, samples)
+    EEG. The 32 EEG channels are stored at positions 1-32 of 40, as the
+    loader expects.
+    """
+    os.makedirs(directory, exist_ok=True)
+    n_samples = eeg.shape[-1]
+    eeg = eeg.reshape(-1, 40, 32, n_samples)
+    ratings = ratings.reshape(-1, 40, 3)
+    paths = []
+
+    for i, (subject_eeg, subject_ratings) in enumerate(zip(eeg, ratings)):
+        data = np.zeros((40, 40, n_samples), dtype=subject_eeg.dtype)
+        data[:, 1:33] = subject_eeg
+
+        labels = np.concatenate([subject_ratings, np.ones((40, 1))], axis=1)
+
+        path = os.path.join(directory, f"s{i + 1:02d}.dat")
+        with open(path, "wb") as file:
+            pickle.dump({"data": data, "labels": labels}, file)
+
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import numpy as np
+
+from datasets.data_loader import DATASET_CHANNELS, load_subjects
+from datasets.utils import LabelMapper
+from evaluation import compute_metrics
+from feature_cache import load_features
+from feature_creation import subject_folds, windows_per_trial
+from workers import run_main, worker_pool
+
+
+# =====================================
+# Folds
+# =====================================
+
+def cv_name(args):
+    """
+    Name of the cross-validation protocol of a run, or None for the
+    single random split.
+    """
+    cv = getattr(args, "cv", None)
+
+    if cv == "kfold":
+        return f"kfold{args.folds}"
+
+    return cv
+
+
+def fold_args(args, fold):
+    return argparse.Namespace(**{**vars(args), "fold": fold})
+
+
+def load_groups(dataset_name, n_rows):
+    """
+    Subject id of every feature row.
+
+    Rows are laid out trial by trial, like the labels, so each trial's
+    subject is repeated over its rows.
+    """
+    subjects = load_subjects(dataset_name)
+
+    if n_rows % len(subjects):
+        raise ValueError(
+            f"{n_rows} feature rows do not split evenly over {len(subjects)} trials"
+        )
+
+    return np.repeat(subjects, n_rows // len(subjects))
+
+
+def prepare_folds(args):
+    """
+    Builds the features once and writes each fold's split.npz to its
+    results directory, where main.load_split picks it up. Besides the train
+    and test rows, each split holds validation rows from held-back training
+    subjects.
+
+    Returns:
+        list: Held-out subjects of every fold
+    """
+    from main import get_results_dir
+
+    # Fills the cache on a miss; the fold processes only memory-map it
+    _, y = load_features(
+        args.dataset_name,
+        LabelMapper(args.task, args.num_classes),
+        feature_type=args.feature_type,
+        cache_dir=args.cache_dir,
+        chunk_size=args.chunk_size,
+        dtype=args.dtype,
+        num_workers=args.num_workers
+    )
+
+    groups = load_groups(args.dataset_name, len(y))
+    held_out = []
+
+    for fold, (train_idx, val_idx, test_idx) in enumerate(
+        subject_folds(groups, args.cv, args.folds)
+    ):
+        split_path = os.path.join(get_results_dir(fold_args(args, fold)), "split.npz")
+        np.savez(split_path, train_idx=train_idx, val_idx=val_idx, test_idx=test_idx)
+
+        held_out.append(sorted(np.unique(groups[test_idx]).tolist()))
+
+    return held_out
+
+
+# =====================================
+# Workers
+# =====================================
+
+def run_cv(args):
+    """
+    Trains every fold of ``args.cv`` with main.main in a
+    workers.worker_pool, ``args.cv_workers`` folds at a time, and writes
+    ``cv_summary.json``.
+
+    Returns:
+        float: Mean test accuracy over the folds
+    """
+    from main import get_results_dir, init_experiment_log
+
+    held_out = prepare_folds(args)
+
+    threads = args.threads_per_fold or max(1, (os.cpu_count() or 1) // args.cv_workers)
+    print(f"{cv_name(args)}: {len(held_out)} folds, {args.cv_workers} concurrent, "
+          f"{threads} threads each")
+
+    init_experiment_log()
+
+    jobs = []
+    for fold in range(len(held_out)):
+        fold_run = fold_args(args, fold)
+        jobs.append((fold, fold_run, os.path.join(get_results_dir(fold_run), "train.log"), None))
+
+    results = {}
+
+    with worker_pool(args.cv_workers, threads) as pool:
+
+        for fold, test_acc, error, seconds in pool.imap_unordered(run_main, jobs):
+            status = f"acc={test_acc:.4f}" if error is None else f"FAILED {error}"
+            print(f"fold {fold:02d} ({', '.join(held_out[fold])})\t{status}\t{seconds:.0f}s")
+
+            results[fold] = {"error": error, "seconds": seconds}
+
+    summary = summarize_folds(args, held_out, results)
+
+    with open(os.path.join(get_results_dir(args), "cv_summary.json"), "w") as file:
+        json.dump(summary, file, indent=2)
+
+    print(f"Mean accuracy {summary['mean']['accuracy']:.4f} "
+          f"± {summary['std']['accuracy']:.4f}, pooled {summary['pooled']['accuracy']:.4f}")
+
+    return summary["mean"]["accuracy"]
+
+
+# =====================================
+# Summary
+# =====================================
+
+SUMMARY_METRICS = ("accuracy", "macro_f1", "trial_accuracy_vote", "trial_accuracy_mean")
+
+
+def summarize_folds(args, held_out, results):
+    """
+    Per-fold metrics, their mean and std, and metrics pooled over the
+    predictions of all folds (every row is predicted by exactly one fold).
+    """
+    from main import get_results_dir
+
+    folds = []
+    pooled = {"y_true": [], "probs": [], "indices": []}
+
+    for fold, subjects in enumerate(held_out):
+        record = {"fold": fold, "held_out": subjects, **results[fold]}
+        result_dir = get_results_dir(fold_args(args, fold))
+
+        if record["error"] is None:
+            with open(os.path.join(result_dir, "metrics.json")) as file:
+                metrics = json.load(file)
+            record.update({name: metrics[name] for name in SUMMARY_METRICS})
+
+            predictions = np.load(os.path.join(result_dir, "predictions.npz"))
+            for name in pooled:
+                pooled[name].append(predictions[name])
+
+        folds.append(record)
+
+    finished = [record for record in folds if record["error"] is None]
+
+    if not finished:
+        raise RuntimeError("Every fold failed; see the fold train.log files")
+
+    pooled_metrics = compute_metrics(
+        np.concatenate(pooled["y_true"]),
+        np.concatenate(pooled["probs"]),
+        np.concatenate(pooled["indices"]),
+        windows_per_trial(args.feature_type, DATASET_CHANNELS[args.dataset_name]),
+        args.num_classes
+    )
+
+    return {
+        "cv": cv_name(args),
+        "folds": folds,
+        "finished": len(finished),
+        "mean": {name: float(np.mean([r[name] for r in finished])) for name in SUMMARY_METRICS},
+        "std": {name: float(np.std([r[name] for r in finished])) for name in SUMMARY_METRICS},
+        "pooled": {name: pooled_metrics[name] for name in SUMMARY_METRICS}
+    }
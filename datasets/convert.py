@@ -0,0 +1,89 @@
+import argparse
+import os
+
+from datasets.data_loader import (
+    deap_paths,
+    dens_subject,
+    list_dens_records,
+    map_files,
+    read_deap_subject,
+    read_dens_file
+)
+from datasets.store import STORE_DIR, StoreWriter, get_store_path
+
+
+# =====================================
+# Conversion
+# =====================================
+
+def convert_dens(num_workers=1, store_dir=STORE_DIR):
+
+    paths, records, ratings = list_dens_records()
+
+    writer = StoreWriter("DENS", len(paths), store_dir)
+
+    for i, eeg_data in enumerate(map_files(read_dens_file, paths, num_workers)):
+        writer.append(
+            eeg_data[None],
+            [dens_subject(records[i])],
+            [records[i]],
+            [ratings[i]]
+        )
+
+    writer.close()
+
+
+def convert_deap(num_workers=1, store_dir=STORE_DIR):
+
+    paths = deap_paths()
+
+    writer = StoreWriter("DEAP", 40 * len(paths), store_dir)
+
+    for path, (eeg_data, trial_labels) in zip(
+        paths, map_files(read_deap_subject, paths, num_workers)
+    ):
+        subject = os.path.basename(path)[:-4]
+
+        writer.append(
+            eeg_data[:40],
+            [subject] * 40,
+            [f"{subject}_t{trial:02d}" for trial in range(40)],
+            trial_labels[:40, :3]
+        )
+
+    writer.close()
+
+
+def convert_dataset(dataset_name, num_workers=1, store_dir=STORE_DIR):
+    dataset_name = dataset_name.upper()
+
+    if dataset_name == "DENS":
+        convert_dens(num_workers, store_dir)
+
+    elif dataset_name == "DEAP":
+        convert_deap(num_workers, store_dir)
+
+    else:
+        raise ValueError(f"Unsupported dataset: {dataset_name}")
+
+    return get_store_path(dataset_name, store_dir)
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Convert a raw dataset into a memory-mapped EEG store"
+    )
+
+    parser.add_argument('--dataset_name', choices=['DEAP', 'DENS'], required=True)
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--store_dir', default=STORE_DIR)
+
+    args = parser.parse_args()
+
+    path = convert_dataset(args.dataset_name, args.num_workers, args.store_dir)
+    print("Store written to:", path)
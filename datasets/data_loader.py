@@ -1,126 +1,377 @@
+import hashlib
+import json
 import os
 import numpy as np
 import pandas as pd
 import scipy.io as sio
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 
+from datasets.store import STORE_DIR, EEGStore, get_store_path, has_store
 
-def load_dataset(dataset_name, label_mapper):
+
+DENS_RATING_PATH = "data/DENS/wholeFrequencyDependentDataWithVADLFR_ReFormattingWholeFrequencyVA.xlsx"
+DENS_RATING_CACHE = os.path.join("cache", "dens_ratings.npz")
+
+# EEG channels per trial
+DATASET_CHANNELS = {"DENS": 128, "DEAP": 32}
+
+
+def load_dataset(dataset_name, label_mapper, num_workers=1, trials=None,
+                 channels=None, store_dir=STORE_DIR):
+    """
+    Loads raw EEG and mapped labels.
+
+    If the dataset was converted with ``python -m datasets.convert``, the EEG is
+    memory-mapped from the store and only the requested trials and channels
+    are read. Otherwise the raw files are decoded.
+
+    Args:
+        dataset_name (str): 'DEAP' or 'DENS'
+        label_mapper (LabelMapper): Label mapping for the task
+        num_workers (int): Processes decoding files in parallel (1 = serial).
+            Files are returned in the same order either way.
+        trials (array-like, optional): Trials to load (store only)
+        channels (array-like, optional): Channels to load (store only)
+        store_dir (str): Root directory of converted datasets
+    """
+    eeg_data, ratings = load_raw_dataset(
+        dataset_name, num_workers, trials, channels, store_dir
+    )
+    return eeg_data, map_labels(ratings, label_mapper, dataset_name)
+
+
+def load_raw_dataset(dataset_name, num_workers=1, trials=None, channels=None,
+                     store_dir=STORE_DIR):
+    """
+    Loads raw EEG and the unmapped (valence, arousal, dominance) ratings.
+
+    Label mappings are cheap to apply with map_labels, so callers that need
+    several tasks of one dataset load it once with this function.
+
+    Returns:
+        tuple: (eeg_data, ratings) with EEG of shape (trials, channels,
+        samples) and ratings of shape (trials, 3)
+    """
     dataset_name = dataset_name.upper()
 
+    if has_store(dataset_name, store_dir):
+        store = EEGStore(dataset_name, store_dir)
+        return _load_from_store(store, trials, channels)
+
+    if trials is not None or channels is not None:
+        raise ValueError(
+            f"Selecting trials or channels requires a converted store for {dataset_name}"
+        )
+
     if dataset_name == "DENS":
-        return _load_dens(label_mapper)
+        return _load_dens(num_workers)
 
     elif dataset_name == "DEAP":
-        return _load_deap(label_mapper)
+        return _load_deap(num_workers)
 
     else:
         raise ValueError(f"Unsupported dataset: {dataset_name}")
 
 
-def _load_dens(label_mapper):
+def load_ratings(dataset_name, num_workers=1, store_dir=STORE_DIR):
+    """
+    The (trials, 3) valence/arousal/dominance ratings of load_raw_dataset,
+    without decoding the EEG of a store or of DENS. DEAP keeps its ratings
+    inside the subject files, so those are still read.
+    """
+    dataset_name = dataset_name.upper()
+
+    if has_store(dataset_name, store_dir):
+        return EEGStore(dataset_name, store_dir).ratings
+
+    if dataset_name == "DENS":
+        return np.array(list_dens_records()[2]).reshape(-1, 3)
+
+    elif dataset_name == "DEAP":
+        return np.concatenate([
+            trial_labels[:40, :3]
+            for _, trial_labels in map_files(read_deap_subject, deap_paths(), num_workers)
+        ])
+
+    else:
+        raise ValueError(f"Unsupported dataset: {dataset_name}")
+
+
+def load_subjects(dataset_name, store_dir=STORE_DIR):
+    """
+    Subject of every trial, in the trial order of load_raw_dataset.
+
+    Read from the store index if the dataset was converted; otherwise
+    derived from the raw file names, without decoding any EEG.
+
+    Returns:
+        np.ndarray: (trials,) subject ids
+    """
+    dataset_name = dataset_name.upper()
+
+    if has_store(dataset_name, store_dir):
+        return np.asarray(EEGStore(dataset_name, store_dir).subject)
+
+    if dataset_name == "DENS":
+        _, records, _ = list_dens_records()
+        return np.array([dens_subject(record) for record in records])
+
+    elif dataset_name == "DEAP":
+        subjects = [os.path.basename(path)[:-4] for path in deap_paths()]
+        return np.repeat(subjects, 40)
+
+    else:
+        raise ValueError(f"Unsupported dataset: {dataset_name}")
+
+
+def source_fingerprint(dataset_name, store_dir=STORE_DIR):
+    """
+    Digest of the files a dataset is loaded from: the store, or the raw
+    recordings (and the DENS rating sheet). Each file contributes its name,
+    size and mtime, in loading order, so adding, removing or rewriting a
+    recording changes the fingerprint.
+    """
+    dataset_name = dataset_name.upper()
+
+    if has_store(dataset_name, store_dir):
+        path = get_store_path(dataset_name, store_dir)
+        paths = [os.path.join(path, "eeg.npy"), os.path.join(path, "index.npz")]
+
+    elif dataset_name == "DENS":
+        paths = list_dens_records()[0] + [DENS_RATING_PATH]
+
+    elif dataset_name == "DEAP":
+        paths = deap_paths()
+
+    else:
+        raise ValueError(f"Unsupported dataset: {dataset_name}")
+
+    files = []
+    for path in paths:
+        stat = os.stat(path)
+        files.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+
+    return hashlib.sha1(json.dumps(files).encode("utf-8")).hexdigest()
+
+
+def dens_subject(record):
+    """
+    Subject of a DENS recording.
 
+    DENS file names are assumed to be ``<subject>_<clip>``, so the subject
+    is the text before the first underscore. Records that do not follow
+    this pattern raise a ValueError instead of forming a subject of their
+    own.
+    """
+    subject, separator, _ = record.partition("_")
+
+    if not separator or not subject:
+        raise ValueError(
+            f"DENS record {record!r} does not match <subject>_<clip>; "
+            "the subject cannot be derived"
+        )
+
+    return subject
+
+
+def map_labels(ratings, label_mapper, dataset_name):
+    """
+    Maps (trials, 3) valence/arousal/dominance ratings to one label per trial.
+    """
+    return np.array([
+        _map_label(label_mapper, valence, arousal, dominance, dataset_name)
+        for valence, arousal, dominance in ratings
+    ])
+
+
+def map_files(func, paths, num_workers):
+    """
+    Yields ``func(path)`` for every path, decoded by ``num_workers``
+    processes (1 = serial).
+    """
+    # executor.map yields results in submission order, so the output
+    # ordering never depends on which worker finishes first
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            yield from executor.map(func, paths)
+
+    else:
+        for path in paths:
+            yield func(path)
+
+
+def _map_label(label_mapper, valence, arousal, dominance, dataset_name):
+
+    # 🔥 Mode-aware mapping
+    if label_mapper.mode == 'VAD':
+        return label_mapper(
+            valence=valence,
+            arousal=arousal,
+            dominance=dominance
+        )
+
+    elif label_mapper.mode == 'A':
+        return label_mapper(arousal=arousal)
+
+    elif label_mapper.mode == 'V':
+        return label_mapper(valence=valence)
+
+    else:
+        raise ValueError(f"Unsupported mode {label_mapper.mode} for {dataset_name}")
+
+
+def read_dens_file(path):
+    """
+    EEG of one DENS recording, (128, samples).
+    """
+    mat = sio.loadmat(path)
+    return mat.get("eegData")
+
+
+def read_deap_subject(path):
+    """
+    EEG (trials, 32, samples) and raw label rows of one DEAP subject file.
+    """
+    with open(path, "rb") as file:
+        subject = pickle.load(file, encoding="latin1")
+
+    # Use EEG channels only (1–32)
+    eeg_data = np.ascontiguousarray(subject["data"][:, 1:33])
+
+    return eeg_data, subject["labels"]
+
+
+def _load_dens_ratings(path=DENS_RATING_PATH, cache_path=DENS_RATING_CACHE):
+    """
+    Returns {record: (valence, arousal, dominance)}, keyed by every form of
+    a Subject entry that names a recording (see _rating_keys).
+
+    The workbook is parsed once and stored as a small .npz next to the other
+    caches; it is re-parsed only when the workbook's size or mtime changes.
+    """
+    stat = os.stat(path)
+    source = np.array([stat.st_size, stat.st_mtime_ns])
+
+    if os.path.isfile(cache_path):
+        cached = np.load(cache_path)
+
+        if np.array_equal(cached["source"], source):
+            return _index_ratings(cached["subject"].tolist(), cached["values"])
+
+    rating = pd.read_excel(path)
+    rating = rating[['Subject', 'valence', 'arousal', 'Dominance']]
+    rating = rating[rating["Subject"].apply(lambda subject: isinstance(subject, str))]
+
+    # The first row of a subject wins, as with the old per-file lookup
+    rating = rating.drop_duplicates(subset="Subject")
+
+    subjects = rating["Subject"].to_numpy(dtype=str)
+    values = rating[['valence', 'arousal', 'Dominance']].to_numpy(dtype=np.float64)
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path[:-len(".npz")] + f".tmp{os.getpid()}.npz"
+    np.savez(tmp_path, source=source, subject=subjects, values=values)
+    os.replace(tmp_path, cache_path)
+
+    return _index_ratings(subjects.tolist(), values)
+
+
+def _rating_keys(subject):
+    """
+    Record names a Subject entry can stand for: the entry itself, and the
+    file stem it embeds (surrounding whitespace, directories and a file
+    extension removed).
+    """
+    stem = subject.strip().replace("\\", "/").rsplit("/", 1)[-1]
+
+    return subject, stem, os.path.splitext(stem)[0]
+
+
+def _index_ratings(subjects, values):
+    # Built once, so looking up a recording is a single dict access. Exact
+    # Subject entries win over derived stems; otherwise the first row in
+    # sheet order wins
+    ratings = dict(zip(subjects, values))
+
+    for subject, subject_values in zip(subjects, values):
+        for key in _rating_keys(subject)[1:]:
+            ratings.setdefault(key, subject_values)
+
+    return ratings
+
+
+def list_dens_records():
+    """
+    Returns (paths, records, ratings) of the DENS recordings that have a rating.
+    """
     base_path = "data/DENS/Emotional/"
-    rating = pd.read_excel(
-        "data/DENS/wholeFrequencyDependentDataWithVADLFR_ReFormattingWholeFrequencyVA.xlsx"
-    )
+    ratings = _load_dens_ratings()
 
-    eeg_data = []
-    eeg_labels = []
+    paths = []
+    records = []
+    record_ratings = []
 
     _, _, files = next(os.walk(base_path))
 
-    for f in files:
+    # Directory order is arbitrary; trials must come in a reproducible order
+    for f in sorted(files):
         if not f.endswith(".mat"):
             continue
 
         file_str = f[:-4]
-        df = rating[rating["Subject"].str.contains(file_str)]
+        values = ratings.get(file_str)
 
-        if df.empty:
+        if values is None:
             continue
 
-        df = df[['Subject', 'valence', 'arousal', 'Dominance']]
-        df = df.drop_duplicates()
-
-        valence = df["valence"].values[0]
-        arousal = df["arousal"].values[0]
-        dominance = df["Dominance"].values[0]
+        paths.append(os.path.join(base_path, f))
+        records.append(file_str)
+        record_ratings.append(values)
 
-        mat = sio.loadmat(os.path.join(base_path, f))
-        data = mat.get("eegData")
+    return paths, records, record_ratings
 
-        # 🔥 Mode-aware mapping
-        if label_mapper.mode == 'VAD':
-            label = label_mapper(
-                valence=valence,
-                arousal=arousal,
-                dominance=dominance
-            )
 
-        elif label_mapper.mode == 'A':
-            label = label_mapper(arousal=arousal)
-
-        elif label_mapper.mode == 'V':
-            label = label_mapper(valence=valence)
+def deap_paths():
+    """
+    Paths of the 32 DEAP subject files.
+    """
+    subject_list = [f"{i:02d}" for i in range(1, 33)]
+    return [f"data/DEAP/s{sub}.dat" for sub in subject_list]
 
-        else:
-            raise ValueError(f"Unsupported mode {label_mapper.mode} for DENS")
 
-        eeg_data.append(data)
-        eeg_labels.append(label)
+def _load_dens(num_workers=1):
 
-    eeg_data = np.array(eeg_data)
-    eeg_labels = np.array(eeg_labels)
+    paths, _, ratings = list_dens_records()
 
-    return eeg_data, eeg_labels
+    eeg_data = np.array(list(map_files(read_dens_file, paths, num_workers)))
+    ratings = np.array(ratings).reshape(-1, 3)
 
+    return eeg_data, ratings
 
 
-def _load_deap(label_mapper):
 
-    subject_list = [f"{i:02d}" for i in range(1, 33)]
+def _load_deap(num_workers=1):
 
     data = []
-    labels = []
-
-    for sub in subject_list:
-
-        with open(f"data/DEAP/s{sub}.dat", "rb") as file:
-            subject = pickle.load(file, encoding="latin1")
-
-            for trial in range(40):
+    ratings = []
 
-                eeg_data = subject["data"][trial]
-                trial_labels = subject["labels"][trial]
+    for eeg_data, trial_labels in map_files(read_deap_subject, deap_paths(), num_workers):
 
-                valence = trial_labels[0]
-                arousal = trial_labels[1]
-                dominance = trial_labels[2]
+        # Valence, arousal and dominance of the 40 trials
+        ratings.append(trial_labels[:40, :3])
+        data.append(eeg_data[:40])
 
-                # 🔥 Mode-aware mapping
-                if label_mapper.mode == 'VAD':
-                    label = label_mapper(
-                        valence=valence,
-                        arousal=arousal,
-                        dominance=dominance
-                    )
+    data = np.concatenate(data)
+    ratings = np.concatenate(ratings)
 
-                elif label_mapper.mode == 'A':
-                    label = label_mapper(arousal=arousal)
+    return data, ratings
 
-                elif label_mapper.mode == 'V':
-                    label = label_mapper(valence=valence)
 
-                else:
-                    raise ValueError(f"Unsupported mode {label_mapper.mode} for DEAP")
 
-                # Use EEG channels only (1–32)
-                for ch in range(1, 33):
-                    data.append(eeg_data[ch])
-                    labels.append(label)
+def _load_from_store(store, trials=None, channels=None):
 
-    data = np.array(data)
-    labels = np.array(labels)
+    eeg_data = store.trials(trials, channels)
+    ratings = store.ratings if trials is None else store.ratings[trials]
 
-    return data, labels
+    return eeg_data, ratings
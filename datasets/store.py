@@ -0,0 +1,120 @@
+import os
+import numpy as np
+
+
+STORE_DIR = os.path.join("data", "store")
+
+
+def get_store_path(dataset_name, store_dir=STORE_DIR):
+    return os.path.join(store_dir, dataset_name.upper())
+
+
+def has_store(dataset_name, store_dir=STORE_DIR):
+    path = get_store_path(dataset_name, store_dir)
+    return os.path.isfile(os.path.join(path, "index.npz"))
+
+
+class EEGStore:
+    """
+    Memory-mapped raw EEG of a converted dataset.
+
+    Layout of ``<store_dir>/<DATASET>/``:
+        eeg.npy    (trials, channels, samples) EEG, opened with mmap_mode='r'
+        index.npz  per-trial ``subject``, ``record`` and ``ratings``
+                   (valence, arousal, dominance)
+    """
+
+    def __init__(self, dataset_name, store_dir=STORE_DIR):
+        path = get_store_path(dataset_name, store_dir)
+
+        self.eeg = np.load(os.path.join(path, "eeg.npy"), mmap_mode="r")
+
+        index = np.load(os.path.join(path, "index.npz"))
+        self.subject = index["subject"]
+        self.record = index["record"]
+        self.ratings = index["ratings"]
+
+    def __len__(self):
+        return len(self.eeg)
+
+    def trials(self, trials=None, channels=None):
+        """
+        Returns the EEG of the selected trials and channels.
+
+        Without a selection this is a view of the memory map, so nothing is
+        read until the samples are used.
+        """
+        if trials is not None and channels is not None:
+            # One gather reads only the selected channels of each trial,
+            # instead of copying whole trials first
+            return self.eeg[np.ix_(np.asarray(trials), np.asarray(channels))]
+
+        if trials is not None:
+            return self.eeg[np.asarray(trials)]
+
+        if channels is not None:
+            return self.eeg[:, np.asarray(channels)]
+
+        return self.eeg
+
+
+class StoreWriter:
+    """
+    Writes a store one trial block at a time, so converting a dataset never
+    holds more than one decoded file in memory.
+    """
+
+    def __init__(self, dataset_name, n_trials, store_dir=STORE_DIR):
+        self.path = get_store_path(dataset_name, store_dir)
+        self.n_trials = n_trials
+        self.position = 0
+        self.eeg = None
+
+        self.subject = []
+        self.record = []
+        self.ratings = []
+
+        os.makedirs(self.path, exist_ok=True)
+        self._eeg_tmp = os.path.join(self.path, f"eeg.tmp{os.getpid()}.npy")
+
+    def append(self, eeg, subjects, records, ratings):
+        """
+        Args:
+            eeg (np.ndarray): (trials, channels, samples) block
+            subjects, records (list): Per-trial identifiers
+            ratings (array-like): Per-trial (valence, arousal, dominance)
+        """
+        if self.eeg is None:
+            self.eeg = np.lib.format.open_memmap(
+                self._eeg_tmp,
+                mode="w+",
+                dtype=eeg.dtype,
+                shape=(self.n_trials,) + eeg.shape[1:]
+            )
+
+        self.eeg[self.position:self.position + len(eeg)] = eeg
+        self.position += len(eeg)
+
+        self.subject.extend(subjects)
+        self.record.extend(records)
+        self.ratings.extend(np.asarray(ratings, dtype=np.float64))
+
+    def close(self):
+        if self.position != self.n_trials:
+            raise ValueError(
+                f"Store expected {self.n_trials} trials, got {self.position}"
+            )
+
+        self.eeg.flush()
+        self.eeg = None
+        os.replace(self._eeg_tmp, os.path.join(self.path, "eeg.npy"))
+
+        # The index is written last: its presence marks a complete store
+        index_tmp = os.path.join(self.path, f"index.tmp{os.getpid()}.npz")
+        np.savez(
+            index_tmp,
+            subject=np.array(self.subject, dtype=str),
+            record=np.array(self.record, dtype=str),
+            ratings=np.array(self.ratings).reshape(-1, 3)
+        )
+        os.replace(index_tmp, os.path.join(self.path, "index.npz"))
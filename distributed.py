@@ -0,0 +1,166 @@
+import json
+import os
+import socket
+import time
+import numpy as np
+import tensorflow as tf
+
+from datasets.utils import LabelMapper
+from feature_cache import load_features
+from feature_creation import load_split
+from pipeline import make_dataset
+from workers import run_main, worker_pool
+
+
+# =====================================
+# Worker Side
+# =====================================
+
+def is_worker():
+    """
+    True inside a multi-worker process, i.e. when TF_CONFIG describes the
+    cluster (set by run_distributed, or by hand on a real cluster).
+    """
+    return "TF_CONFIG" in os.environ
+
+
+def make_strategy():
+    """
+    MultiWorkerMirroredStrategy over the TF_CONFIG cluster. Gradients are
+    all-reduced across the workers every step.
+
+    Must run before any other TensorFlow op of the process.
+
+    Returns:
+        tuple: (strategy, is_chief)
+    """
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+    )
+
+    resolver = strategy.cluster_resolver
+    is_chief = resolver.task_type in (None, "chief") or (
+        resolver.task_type == "worker" and resolver.task_id == 0
+    )
+
+    return strategy, is_chief
+
+
+def shard_indices(indices, num_shards, index):
+    # Shards have equal length: every worker has to run the same number of
+    # steps, or the gradient all-reduce of the last step never completes
+    size = len(indices) // num_shards
+    return np.asarray(indices)[index::num_shards][:size]
+
+
+def distribute_dataset(strategy, X, y, indices, batch_size=256, cache=None, **kwargs):
+    """
+    make_dataset over this worker's shard of ``indices``, distributed for
+    model.fit. ``batch_size`` is the global batch, split over the workers.
+
+    Keras keeps one iterator over a dataset with a fixed number of steps,
+    so the shard repeats and the returned steps mark the epochs.
+
+    Returns:
+        tuple: (dataset, steps per epoch)
+    """
+    num_replicas = strategy.num_replicas_in_sync
+    per_replica = max(1, batch_size // num_replicas)
+    steps = -(-(len(indices) // num_replicas) // per_replica)
+
+    def dataset_fn(context):
+        shard = shard_indices(indices, context.num_input_pipelines, context.input_pipeline_id)
+
+        # Cache files are per worker
+        shard_cache = cache
+        if cache:
+            shard_cache = f"{cache}_w{context.input_pipeline_id}"
+
+        dataset = make_dataset(X, y, shard, batch_size=per_replica, cache=shard_cache, **kwargs)
+        return dataset.repeat()
+
+    return strategy.distribute_datasets_from_function(dataset_fn), steps
+
+
+# =====================================
+# Local Launcher
+# =====================================
+
+def _free_ports(n):
+    sockets = [socket.socket() for _ in range(n)]
+
+    for sock in sockets:
+        sock.bind(("localhost", 0))
+
+    ports = [sock.getsockname()[1] for sock in sockets]
+
+    for sock in sockets:
+        sock.close()
+
+    return ports
+
+
+def run_distributed(args):
+    """
+    Runs main.main in ``args.distributed_workers`` local worker processes
+    that train one model together over localhost.
+
+    Returns:
+        float: Test accuracy reported by the chief
+    """
+    from main import get_results_dir
+
+    workers = args.distributed_workers
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    cluster = {"worker": [f"localhost:{port}" for port in _free_ports(workers)]}
+    print(f"Training on {workers} local workers, {threads} threads each: {cluster['worker']}")
+
+    # The workers only memory-map the cache and read the split, so both
+    # are created here, once
+    X_full, _ = load_features(
+        args.dataset_name,
+        LabelMapper(args.task, args.num_classes),
+        feature_type=args.feature_type,
+        cache_dir=args.cache_dir,
+        chunk_size=args.chunk_size,
+        dtype=args.dtype,
+        num_workers=args.num_workers
+    )
+
+    result_dir = get_results_dir(args)
+    load_split(os.path.join(result_dir, "split.npz"), len(X_full))
+
+    # The chief keeps the terminal; the other workers get their own logs
+    jobs = [
+        (
+            index,
+            args,
+            None if index == 0 else os.path.join(result_dir, f"worker_{index}.log"),
+            {"TF_CONFIG": json.dumps(
+                {"cluster": cluster, "task": {"type": "worker", "index": index}}
+            )}
+        )
+        for index in range(workers)
+    ]
+
+    start = time.perf_counter()
+    test_acc = None
+
+    # One task per process: every worker has to be up for the collectives
+    with worker_pool(workers, threads) as pool:
+
+        for index, result, error, _ in pool.imap_unordered(run_main, jobs, chunksize=1):
+            if error is not None:
+                # The other workers would wait on the failed one forever
+                pool.terminate()
+                raise RuntimeError(f"Worker {index} failed: {error}")
+
+            if index == 0:
+                test_acc = result
+
+    print(f"Distributed training finished in {time.perf_counter() - start:.0f}s")
+
+    return test_acc
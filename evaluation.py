@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from sklearn.metrics import confusion_matrix, precision_recall_fscore_support
+
+from datasets.data_loader import DATASET_CHANNELS
+from datasets.utils import LabelMapper
+from feature_cache import CACHE_DIR, load_features
+from feature_creation import load_split, windows_per_trial
+from model import ARCHITECTURES, DEFAULT_ARCH
+from pipeline import make_dataset
+
+
+# =====================================
+# Prediction
+# =====================================
+
+def make_logit_function(model):
+    """
+    tf.function returning (logits, probabilities) of a batch.
+
+    For the models of model.py, whose last layer is a softmax Dense, the
+    logits are that layer's pre-activation; otherwise the log-probabilities
+    are returned in their place.
+    """
+    last = model.layers[-1]
+
+    # Compared by name: the function object differs between Keras versions
+    # and for models loaded from .h5
+    if (
+        isinstance(last, tf.keras.layers.Dense)
+        and getattr(last.activation, "__name__", None) == "softmax"
+    ):
+        features = tf.keras.Model(model.inputs, last.input)
+
+        @tf.function(reduce_retracing=True)
+        def forward(x):
+            hidden = tf.cast(features(x, training=False), last.kernel.dtype)
+            logits = tf.matmul(hidden, last.kernel) + last.bias
+            return logits, tf.nn.softmax(logits)
+
+    else:
+        @tf.function(reduce_retracing=True)
+        def forward(x):
+            probs = tf.cast(model(x, training=False), tf.float32)
+            return tf.math.log(probs + 1e-12), probs
+
+    return forward
+
+
+def predict_dataset(model, dataset):
+    """
+    One pass over ``dataset`` (batches of (x, y[, w])).
+
+    Returns:
+        tuple: (y_true, logits, probs) in dataset order
+    """
+    forward = make_logit_function(model)
+
+    y_true, logits, probs = [], [], []
+
+    for batch in dataset:
+        batch_logits, batch_probs = forward(batch[0])
+
+        y_true.append(batch[1].numpy())
+        logits.append(batch_logits.numpy())
+        probs.append(batch_probs.numpy())
+
+    return np.concatenate(y_true), np.concatenate(logits), np.concatenate(probs)
+
+
+# =====================================
+# Metrics
+# =====================================
+
+def compute_metrics(y_true, probs, indices, n_windows, num_classes):
+    """
+    Window-level and trial-level metrics.
+
+    Args:
+        y_true (np.ndarray): Labels of the evaluated rows
+        probs (np.ndarray): (rows, classes) probabilities
+        indices (np.ndarray): Feature-tensor rows that were evaluated
+        n_windows (int): Feature rows per trial (windows_per_trial)
+        num_classes (int): Number of classes
+
+    Returns:
+        dict: accuracy, per-class precision / recall / F1 / support, macro
+        F1, confusion matrix, and trial accuracy by majority vote and by
+        mean probability over each trial's evaluated windows
+    """
+    classes = np.arange(num_classes)
+    y_pred = np.argmax(probs, axis=1)
+
+    precision, recall, f1, support = precision_recall_fscore_support(
+        y_true, y_pred, labels=classes, zero_division=0
+    )
+
+    # Trials of the evaluated windows; a trial's windows share its label
+    trials, trial_of_row = np.unique(np.asarray(indices) // n_windows, return_inverse=True)
+
+    votes = np.zeros((len(trials), num_classes))
+    np.add.at(votes, (trial_of_row, y_pred), 1)
+
+    mean_probs = np.zeros((len(trials), num_classes))
+    np.add.at(mean_probs, trial_of_row, probs)
+
+    trial_true = np.zeros(len(trials), dtype=y_true.dtype)
+    trial_true[trial_of_row] = y_true
+
+    return {
+        "accuracy": float(np.mean(y_pred == y_true)),
+        "precision": precision.tolist(),
+        "recall": recall.tolist(),
+        "f1": f1.tolist(),
+        "support": support.astype(int).tolist(),
+        "macro_f1": float(np.mean(f1)),
+        "confusion_matrix": confusion_matrix(y_true, y_pred, labels=classes).tolist(),
+        "n_trials": int(len(trials)),
+        "trial_accuracy_vote": float(np.mean(np.argmax(votes, axis=1) == trial_true)),
+        "trial_accuracy_mean": float(np.mean(np.argmax(mean_probs, axis=1) == trial_true))
+    }
+
+
+def evaluate_model(model, dataset, indices, feature_type, num_classes, result_dir=None,
+                   n_channels=128):
+    """
+    Evaluates ``model`` in a single prediction pass.
+
+    ``indices`` are the feature rows behind ``dataset``, in its order (the
+    sorted indices of load_split, batched without shuffling). ``n_channels``
+    is the dataset's EEG channel count, which sets the WSIS rows per trial.
+
+    With ``result_dir``, the metrics are written to ``metrics.json`` and the
+    raw outputs (row indices, labels, logits, probabilities) to
+    ``predictions.npz``, so later analysis never has to re-run the model.
+
+    Returns:
+        tuple: (metrics, y_true, y_pred)
+    """
+    y_true, logits, probs = predict_dataset(model, dataset)
+
+    if len(y_true) != len(indices):
+        raise ValueError(f"Dataset yielded {len(y_true)} rows, expected {len(indices)}")
+
+    metrics = compute_metrics(
+        y_true, probs, indices, windows_per_trial(feature_type, n_channels), num_classes
+    )
+
+    if result_dir is not None:
+        np.savez(
+            os.path.join(result_dir, "predictions.npz"),
+            indices=np.asarray(indices),
+            y_true=y_true,
+            logits=logits,
+            probs=probs
+        )
+
+        with open(os.path.join(result_dir, "metrics.json"), "w") as file:
+            json.dump(metrics, file, indent=2)
+
+    return metrics, y_true, np.argmax(probs, axis=1)
+
+
+def format_metrics(metrics):
+    lines = [
+        f"Accuracy: {metrics['accuracy']:.4f}  Macro F1: {metrics['macro_f1']:.4f}",
+        f"Trial accuracy ({metrics['n_trials']} trials): "
+        f"vote {metrics['trial_accuracy_vote']:.4f}, mean {metrics['trial_accuracy_mean']:.4f}"
+    ]
+
+    for c, (p, r, f, n) in enumerate(zip(
+        metrics["precision"], metrics["recall"], metrics["f1"], metrics["support"]
+    )):
+        lines.append(f"  class {c}: precision {p:.4f}  recall {r:.4f}  f1 {f:.4f}  n={int(n)}")
+
+    return "\n".join(lines)
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    from main import get_checkpoint_path, get_results_dir
+
+    parser = argparse.ArgumentParser(
+        description="Re-evaluate a trained checkpoint on its test split"
+    )
+
+    parser.add_argument('--dataset_name', choices=['DEAP', 'DENS'], required=True)
+    parser.add_argument('--task', choices=['A', 'V', 'VAD'], required=True)
+    parser.add_argument('--num_classes', type=int, required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--arch', choices=ARCHITECTURES, default=DEFAULT_ARCH)
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--batch_size', type=int, default=1024)
+
+    args = parser.parse_args()
+
+    X_full, y = load_features(
+        args.dataset_name,
+        LabelMapper(args.task, args.num_classes),
+        feature_type=args.feature_type,
+        cache_dir=args.cache_dir,
+        dtype=args.dtype,
+        num_workers=args.num_workers
+    )
+
+    result_dir = get_results_dir(args)
+
+    # A new split could overlap the checkpoint's training rows
+    try:
+        _, test_idx = load_split(
+            os.path.join(result_dir, "split.npz"), len(X_full), create=False
+        )
+    except FileNotFoundError as error:
+        parser.error(f"{error}; re-evaluation needs the split the checkpoint was trained on")
+
+    metrics, _, _ = evaluate_model(
+        load_model(get_checkpoint_path(args)),
+        make_dataset(X_full, y, test_idx, batch_size=args.batch_size),
+        test_idx,
+        args.feature_type,
+        args.num_classes,
+        result_dir,
+        DATASET_CHANNELS[args.dataset_name]
+    )
+
+    print(format_metrics(metrics))
+    print("Evaluation saved to:", result_dir)
@@ -0,0 +1,360 @@
+import argparse
+import gzip
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from sklearn.utils.class_weight import compute_class_weight
+
+from datasets.utils import LabelMapper
+from feature_cache import CACHE_DIR, load_features
+from feature_creation import load_split
+from main import get_checkpoint_path, get_results_dir
+from model import ARCHITECTURES, DEFAULT_ARCH
+from pipeline import make_dataset
+
+
+# Weights pruned by magnitude; biases and normalisation stay dense
+PRUNABLE_WEIGHTS = ("kernel", "recurrent_kernel", "depthwise_kernel", "pointwise_kernel")
+
+
+# =====================================
+# Magnitude Pruning
+# =====================================
+
+def magnitude_masks(model, sparsity):
+    """
+    Per-weight masks that zero the ``sparsity`` fraction of smallest-magnitude
+    entries of every kernel.
+
+    Returns:
+        list: (variable, mask) pairs, with each mask a 0/1 tf.constant of the
+        variable's dtype
+    """
+    masks = []
+
+    for weight in model.trainable_weights:
+        name = weight.name.split("/")[-1].split(":")[0]
+        if name not in PRUNABLE_WEIGHTS:
+            continue
+
+        values = np.abs(weight.numpy()).ravel()
+        n_pruned = int(sparsity * values.size)
+
+        mask = np.ones(values.size, dtype=bool)
+        if n_pruned > 0:
+            mask[np.argpartition(values, n_pruned - 1)[:n_pruned]] = False
+
+        masks.append((weight, tf.constant(mask.reshape(weight.shape), dtype=weight.dtype)))
+
+    return masks
+
+
+def make_mask_function(masks):
+    """
+    tf.function zeroing the pruned entries of every masked variable in one
+    call, on the device that holds the weights.
+    """
+    @tf.function
+    def apply():
+        for weight, mask in masks:
+            weight.assign(weight * mask)
+
+    return apply
+
+
+class MaskCallback(tf.keras.callbacks.Callback):
+    """
+    Keeps pruned weights at zero while fine-tuning.
+
+    The masks are applied after every batch, so a pruned weight never
+    takes part in a forward pass; masking once per epoch would let it
+    regrow in between. The single compiled call keeps this free of host
+    round-trips.
+    """
+
+    def __init__(self, masks):
+        super().__init__()
+        self.apply_masks = make_mask_function(masks)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.apply_masks()
+
+
+def prune_model(model, sparsity, train_data=None, epochs=0):
+    """
+    Prunes ``model`` in place and optionally fine-tunes it with the masks
+    held fixed.
+
+    Returns:
+        float: Fraction of zeros over all prunable weights
+    """
+    masks = magnitude_masks(model, sparsity)
+    make_mask_function(masks)()
+
+    if epochs > 0:
+        model.compile(
+            optimizer=tf.keras.optimizers.Adam(1e-4),
+            loss=tf.keras.losses.sparse_categorical_crossentropy,
+            metrics=['accuracy']
+        )
+        model.fit(train_data, epochs=epochs, verbose=1, callbacks=[MaskCallback(masks)])
+
+    n_total = sum(int(tf.size(mask)) for _, mask in masks)
+    n_zero = n_total - sum(int(tf.math.count_nonzero(mask)) for _, mask in masks)
+
+    return n_zero / max(n_total, 1)
+
+
+# =====================================
+# TFLite Conversion
+# =====================================
+
+def convert_tflite(model, quantization, batch_size, calibration=None):
+    """
+    Converts a Keras model to TFLite with a fixed batch size.
+
+    A static batch lets the converter fuse Keras LSTM/GRU layers into the
+    builtin sequence ops.
+
+    Args:
+        quantization (str): 'float', 'dynamic' (int8 weights, float
+            activations) or 'int8' (int8 weights and activations, calibrated
+            on ``calibration``; float input and output)
+        calibration (np.ndarray, optional): Feature samples for 'int8'
+
+    Returns:
+        bytes: The flatbuffer
+    """
+    input_spec = tf.TensorSpec((batch_size,) + tuple(model.input_shape[1:]), tf.float32)
+    forward = tf.function(lambda x: model(x, training=False), input_signature=[input_spec])
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [forward.get_concrete_function()], model
+    )
+
+    if quantization != "float":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == "int8":
+        def representative_dataset():
+            for start in range(0, len(calibration) - batch_size + 1, batch_size):
+                yield [np.asarray(calibration[start:start + batch_size], dtype=np.float32)]
+
+        converter.representative_dataset = representative_dataset
+
+        # Ops without an int8 kernel fall back to float
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+
+    return converter.convert()
+
+
+def make_tflite_predictor(model_content, num_threads=None):
+    """
+    Returns predict(batch) for a fixed-batch TFLite model.
+    """
+    interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+    interpreter.allocate_tensors()
+
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+
+    def predict(batch):
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+    return predict
+
+
+def make_keras_predictor(model):
+    forward = tf.function(lambda x: model(x, training=False))
+    return lambda batch: forward(batch).numpy()
+
+
+# =====================================
+# Comparison
+# =====================================
+
+def compare_predictor(predict, X, y, indices, batch_size):
+    """
+    Accuracy and per-batch latency of ``predict`` on ``X[indices]``.
+
+    Every batch has exactly ``batch_size`` rows (the last one is padded),
+    as the TFLite models have a fixed batch size.
+    """
+    correct = 0
+    latencies = []
+
+    for start in range(0, len(indices), batch_size):
+        batch_idx = indices[start:start + batch_size]
+        batch = np.zeros((batch_size,) + X.shape[1:], dtype=np.float32)
+        batch[:len(batch_idx)] = X[batch_idx]
+
+        begin = time.perf_counter()
+        probs = predict(batch)
+        latencies.append(time.perf_counter() - begin)
+
+        correct += int((np.argmax(probs[:len(batch_idx)], axis=1) == y[batch_idx]).sum())
+
+    # The first batch includes warm-up (tracing, allocation)
+    latencies = np.array(latencies[1:] or latencies) * 1000
+    p50, p95 = np.percentile(latencies, [50, 95])
+
+    return {
+        "accuracy": correct / len(indices),
+        "latency_ms_p50": float(p50),
+        "latency_ms_p95": float(p95),
+        "batch_size": batch_size
+    }
+
+
+def _size(path):
+    # Zeros from pruning only shrink the file once it is compressed
+    with open(path, "rb") as file:
+        content = file.read()
+
+    return {"size_bytes": len(content), "gzip_bytes": len(gzip.compress(content))}
+
+
+# =====================================
+# Export
+# =====================================
+
+def main(args):
+
+    print("Exporting:", args)
+
+    checkpoint_path = get_checkpoint_path(args)
+    result_dir = get_results_dir(args)
+    base_path = checkpoint_path[:-len(".h5")]
+
+    label_mapper = LabelMapper(args.task, args.num_classes)
+    X_full, y = load_features(
+        args.dataset_name,
+        label_mapper,
+        feature_type=args.feature_type,
+        cache_dir=args.cache_dir,
+        dtype=args.dtype,
+        num_workers=args.num_workers
+    )
+
+    train_idx, test_idx = load_split(os.path.join(result_dir, "split.npz"), len(X_full))
+
+    rng = np.random.default_rng(args.seed)
+    if args.eval_samples and args.eval_samples < len(test_idx):
+        test_idx = np.sort(rng.choice(test_idx, args.eval_samples, replace=False))
+
+    # Calibration only ever sees training rows
+    calibration_idx = np.sort(rng.choice(
+        train_idx, min(args.calibration_samples, len(train_idx)), replace=False
+    ))
+    calibration = np.asarray(X_full[calibration_idx], dtype=np.float32)
+
+    results = {"checkpoint": checkpoint_path, "config": vars(args), "models": {}}
+
+    model = load_model(checkpoint_path)
+    results["models"]["float"] = compare_predictor(
+        make_keras_predictor(model), X_full, y, test_idx, args.batch_size
+    )
+    results["models"]["float"].update(_size(checkpoint_path))
+
+    suffix = ""
+
+    if args.prune > 0:
+        train_data = None
+
+        if args.finetune_epochs > 0:
+            y_train = y[train_idx]
+            classes = np.unique(y_train)
+            weights = compute_class_weight(class_weight='balanced', classes=classes, y=y_train)
+
+            train_data = make_dataset(
+                X_full, y, train_idx,
+                batch_size=256,
+                shuffle=True,
+                class_weight=dict(zip(classes, weights))
+            )
+
+        sparsity = prune_model(model, args.prune, train_data, args.finetune_epochs)
+        suffix = f"_pruned{int(round(args.prune * 100))}"
+
+        pruned_path = base_path + suffix + ".h5"
+        model.save(pruned_path)
+
+        results["models"]["float" + suffix] = compare_predictor(
+            make_keras_predictor(model), X_full, y, test_idx, args.batch_size
+        )
+        results["models"]["float" + suffix].update(_size(pruned_path))
+        results["models"]["float" + suffix]["sparsity"] = sparsity
+
+    name = args.quantization + suffix
+    tflite_path = f"{base_path}{suffix}_{args.quantization}.tflite"
+
+    content = convert_tflite(model, args.quantization, args.batch_size, calibration)
+    with open(tflite_path, "wb") as file:
+        file.write(content)
+
+    results["models"][name] = compare_predictor(
+        make_tflite_predictor(content, args.num_threads),
+        X_full, y, test_idx, args.batch_size
+    )
+    results["models"][name].update(_size(tflite_path))
+    results["models"][name]["path"] = tflite_path
+
+    with open(os.path.join(result_dir, "export.json"), "w") as file:
+        json.dump(results, file, indent=2)
+
+    for variant, metrics in results["models"].items():
+        print(
+            f"{variant:<24}acc={metrics['accuracy']:.4f}  "
+            f"p50={metrics['latency_ms_p50']:.2f} ms/batch  "
+            f"size={metrics['size_bytes'] / 2**20:.2f} MB "
+            f"(gzip {metrics['gzip_bytes'] / 2**20:.2f} MB)"
+        )
+
+    print("Export results saved to:", os.path.join(result_dir, "export.json"))
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Quantize (and optionally prune) a checkpoint for CPU serving"
+    )
+
+    parser.add_argument('--dataset_name', choices=['DEAP', 'DENS'], required=True)
+    parser.add_argument('--task', choices=['A', 'V', 'VAD'], required=True)
+    parser.add_argument('--num_classes', type=int, required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--arch', choices=ARCHITECTURES, default=DEFAULT_ARCH)
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--quantization', choices=['dynamic', 'int8', 'float'], default='int8',
+                        help='dynamic: int8 weights; int8: int8 weights and activations')
+    parser.add_argument('--calibration_samples', type=int, default=512,
+                        help='Training feature rows used to calibrate int8 activations')
+    parser.add_argument('--prune', type=float, default=0.0,
+                        help='Fraction of each kernel zeroed by magnitude before conversion')
+    parser.add_argument('--finetune_epochs', type=int, default=0,
+                        help='Epochs of fine-tuning with the pruning masks fixed')
+    parser.add_argument('--batch_size', type=int, default=64,
+                        help='Fixed batch size of the exported model')
+    parser.add_argument('--eval_samples', type=int, default=0,
+                        help='Test rows used for the comparison (0 = all)')
+    parser.add_argument('--num_threads', type=int, default=os.cpu_count(),
+                        help='TFLite interpreter threads (default: all cores, like TensorFlow)')
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    main(args)
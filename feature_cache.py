@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+from contextlib import nullcontext
+import numpy as np
+
+from datasets.data_loader import load_ratings, load_raw_dataset, map_labels, source_fingerprint
+from feature_creation import (
+    FS,
+    NPERSEG,
+    NOVERLAP,
+    SIS_CHANNEL_MAP,
+    compute_features,
+    feature_shape
+)
+
+
+CACHE_DIR = os.path.join("cache", "features")
+
+
+# =====================================
+# Cache Keys
+# =====================================
+
+def _digest(params):
+    payload = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+def feature_params(dataset_name, feature_type, dtype="float32", source=None):
+    """
+    Everything the feature tensor depends on. Labels are keyed separately
+    so that tasks sharing a dataset and feature type reuse the same tensor.
+    ``source`` is the dataset's source_fingerprint: features and labels of
+    one entry always come from the same recordings.
+    """
+    feature_type = feature_type.upper()
+
+    params = {
+        "dataset": dataset_name.upper(),
+        "feature_type": feature_type,
+        "fs": FS,
+        "nperseg": NPERSEG,
+        "noverlap": NOVERLAP,
+        "dtype": np.dtype(dtype).name
+    }
+
+    if feature_type == "SIS":
+        params["channel_map"] = SIS_CHANNEL_MAP.tolist()
+
+    if source is not None:
+        params["source"] = source
+
+    return params
+
+
+def label_params(label_mapper):
+    return {
+        "mode": label_mapper.mode,
+        "num_classes": label_mapper.num_classes,
+        "encoding": "sparse",
+        "thresholds": [
+            label_mapper.threshold_low,
+            label_mapper.threshold_mid,
+            label_mapper.threshold_high
+        ]
+    }
+
+
+def get_cache_entry(dataset_name, feature_type, dtype="float32", cache_dir=CACHE_DIR,
+                    source=None):
+    if source is None:
+        source = source_fingerprint(dataset_name)
+
+    params = feature_params(dataset_name, feature_type, dtype, source)
+    return os.path.join(cache_dir, _digest(params)), params
+
+
+def _label_filename(label_mapper):
+    params = label_params(label_mapper)
+    return f"y_{label_mapper.mode}{label_mapper.num_classes}_{_digest(params)[:8]}.npy"
+
+
+# =====================================
+# Storage
+# =====================================
+
+def _save_atomic(path, array):
+    # np.save appends ".npy" to names without it, so keep the suffix
+    tmp_path = path[:-len(".npy")] + f".tmp{os.getpid()}.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _build_atomic(path, data, feature_type, chunk_size, dtype):
+    # Features are streamed chunk by chunk into a memory-mapped .npy file,
+    # so building them never holds the whole tensor on the heap
+    tmp_path = path[:-len(".npy")] + f".tmp{os.getpid()}.npy"
+
+    out = np.lib.format.open_memmap(
+        tmp_path,
+        mode="w+",
+        dtype=dtype,
+        shape=feature_shape(np.shape(data), feature_type)
+    )
+    compute_features(
+        data,
+        feature_type,
+        out=out,
+        chunk_size=chunk_size,
+        dtype=dtype
+    )
+    out.flush()
+    del out
+
+    os.replace(tmp_path, path)
+
+
+def _write_meta(entry, params):
+    meta_path = os.path.join(entry, "meta.json")
+
+    if not os.path.isfile(meta_path):
+        with open(meta_path, "w") as file:
+            json.dump(params, file, indent=2)
+
+
+def _stage(profiler, name):
+    return nullcontext() if profiler is None else profiler.stage(name)
+
+
+def prepare_features(dataset_name, label_mappers, feature_types=("SIS",),
+                     cache_dir=CACHE_DIR, chunk_size=32, dtype="float32", num_workers=1,
+                     profiler=None):
+    """
+    Builds every missing feature tensor and label file for a set of tasks.
+
+    The raw dataset is loaded at most once, however many feature types and
+    label mappings are missing; configs that only differ in the label mapping
+    share one feature tensor. If only labels are missing, just the ratings
+    are read. With a profiling.StageProfiler, the raw load
+    and the feature build are recorded as the ``load_dataset`` and
+    ``create_features`` stages.
+
+    Returns:
+        dict: {feature_type: cache entry directory}
+    """
+    entries = {}
+    missing_x = []
+    missing_y = []
+
+    source = source_fingerprint(dataset_name)
+
+    for feature_type in feature_types:
+        entry, params = get_cache_entry(dataset_name, feature_type, dtype, cache_dir, source)
+        entries[feature_type] = entry
+
+        if not os.path.isfile(os.path.join(entry, "X.npy")):
+            missing_x.append((feature_type, entry, params))
+
+        for label_mapper in label_mappers:
+            y_path = os.path.join(entry, _label_filename(label_mapper))
+            if not os.path.isfile(y_path):
+                missing_y.append((feature_type, label_mapper, y_path))
+
+    if not missing_x and not missing_y:
+        return entries
+
+    with _stage(profiler, "load_dataset"):
+        if missing_x:
+            data, ratings = load_raw_dataset(dataset_name, num_workers)
+        else:
+            ratings = load_ratings(dataset_name, num_workers)
+
+    with _stage(profiler, "create_features"):
+        for feature_type, entry, params in missing_x:
+            print(f"Building {feature_type} features, it will take some time...")
+
+            os.makedirs(entry, exist_ok=True)
+            _build_atomic(os.path.join(entry, "X.npy"), data, feature_type, chunk_size, dtype)
+            _write_meta(entry, params)
+
+        for feature_type, label_mapper, y_path in missing_y:
+            labels = map_labels(ratings, label_mapper, dataset_name)
+
+            # Feature rows are laid out trial by trial
+            n_rows = len(np.load(os.path.join(entries[feature_type], "X.npy"), mmap_mode="r"))
+            if n_rows % len(labels):
+                raise ValueError(
+                    f"{n_rows} feature rows do not split evenly over {len(labels)} trials"
+                )
+
+            os.makedirs(os.path.dirname(y_path), exist_ok=True)
+            _save_atomic(y_path, np.repeat(labels, n_rows // len(labels)))
+
+    return entries
+
+
+def load_features(dataset_name, label_mapper, feature_type="SIS",
+                  cache_dir=CACHE_DIR, chunk_size=32, dtype="float32", num_workers=1,
+                  profiler=None):
+    """
+    Returns the full feature tensor and labels, building them on a cache miss.
+
+    Cached arrays are opened with ``mmap_mode='r'``, so repeated runs read
+    them through the page cache instead of rebuilding them on the heap.
+
+    Args:
+        dataset_name (str): 'DEAP' or 'DENS'
+        label_mapper (LabelMapper): Label mapping for the task
+        feature_type (str): 'SIS' or 'WSIS'
+        cache_dir (str): Root directory of the cache
+        chunk_size (int): Trials transformed per chunk on a cache miss
+        dtype (str): Storage dtype of the features ('float32' or 'float16')
+        num_workers (int): Processes decoding raw files on a cache miss
+        profiler (StageProfiler, optional): Records the cache-miss stages
+
+    Returns:
+        tuple: (X_full, y)
+    """
+    entry = prepare_features(
+        dataset_name,
+        [label_mapper],
+        [feature_type],
+        cache_dir=cache_dir,
+        chunk_size=chunk_size,
+        dtype=dtype,
+        num_workers=num_workers,
+        profiler=profiler
+    )[feature_type]
+
+    print("Loading cached features from:", entry)
+
+    X_full = np.load(os.path.join(entry, "X.npy"), mmap_mode="r")
+    y = np.load(os.path.join(entry, _label_filename(label_mapper)), mmap_mode="r")
+
+    if len(y) != len(X_full):
+        raise ValueError(
+            f"Cache entry {entry} has {len(X_full)} feature rows but {len(y)} "
+            f"labels; delete it to rebuild"
+        )
+
+    return X_full, y
@@ -1,11 +1,41 @@
+import os
 import numpy as np
 import math
 from scipy.signal import spectrogram
-from sklearn.model_selection import train_test_split
-from tensorflow.keras.utils import to_categorical
+from sklearn.model_selection import (
+    GroupKFold,
+    GroupShuffleSplit,
+    LeaveOneGroupOut,
+    train_test_split
+)
 import functools
 
 
+# ==============================
+# Spectrogram Parameters
+# ==============================
+FS = 250
+NPERSEG = 125
+NOVERLAP = 62
+
+
+# ==============================
+# SIS Channel Layout
+# ==============================
+# 11x12 scalp layout of the 128 DENS electrodes (129 marks an empty cell)
+SIS_CHANNEL_MAP = np.array([128,32,25,21,127,17,126,14,8,2,1,
+                            125,48,43,38,33,26,22,15,9,10,3,
+                            123,122,44,39,34,28,27,23,18,16,
+                            121,114,120,119,24,19,11,4,124,117,
+                            116,115,110,109,108,113,40,35,29,
+                            20,12,5,118,111,93,104,103,98,41,
+                            36,30,7,13,6,112,105,102,101,100,
+                            107,49,56,45,46,47,42,37,31,97,96,
+                            95,99,57,50,57,58,55,106,80,87,79,
+                            86,92,91,52,53,54,61,62,72,78,77,85,
+                            84,90,94,63,64,59,60,66,67,71,76,82,
+                            83,89,88,68,65,69,70,73,74,75,81,129,
+                            129,129,129]).reshape(11, 12)
 
 
 def _combine_dims(a, i=0, n=1):
@@ -27,7 +57,64 @@ def _generate_spatial_windows(arr):
     return windows
 
 
+def _spatial_window_positions(arr):
+    """
+    Top-left grid position (row, col) of every window, in the order of
+    _generate_spatial_windows.
+    """
+    positions = []
+
+    for i in range(arr.shape[0] - 1):
+        for j in range(arr.shape[1] - 1):
+            if not np.any(arr[i:i+2, j:j+2] == 129):
+                positions.append((i, j))
+
+    return positions
+
+
+def _sis_gather_index(channel_map):
+    """
+    Flattens the 2x2 spatial windows of a channel map into one index array.
 
+    Args:
+        channel_map (np.ndarray): 2D grid of 1-based channel numbers
+
+    Returns:
+        np.ndarray: 0-based channel indices, four consecutive entries per window
+    """
+    windows = _generate_spatial_windows(channel_map)
+    return np.array(windows).reshape(-1) - 1
+
+
+def batched_spectrogram(rows, out, fs, nperseg, noverlap, chunk_size=1024):
+    """
+    Computes the spectrograms of a whole block of signals in chunks.
+
+    Args:
+        rows (np.ndarray): Signals of shape (n, ..., samples)
+        out (np.ndarray): Destination of shape (n, ..., f, t), written in place
+        chunk_size (int): Number of entries along the first axis per STFT call
+
+    Returns:
+        np.ndarray: ``out``
+    """
+    for start in range(0, len(rows), chunk_size):
+        stop = min(start + chunk_size, len(rows))
+        _, _, Sxx = spectrogram(
+            rows[start:stop],
+            fs,
+            nperseg=nperseg,
+            noverlap=noverlap,
+            mode='psd',
+            axis=-1
+        )
+        out[start:stop] = Sxx
+
+    return out
+
+
+SIS_GATHER_INDEX = _sis_gather_index(SIS_CHANNEL_MAP)
+SIS_WINDOW_POSITIONS = np.array(_spatial_window_positions(SIS_CHANNEL_MAP))
 
 
 
@@ -37,133 +124,288 @@ def _generate_spatial_windows(arr):
 # ==============================
 def create_features(eeg_data, eeg_labels, feature_type="SIS"):
 
+    X_full = compute_features(eeg_data, feature_type)
+    y = expand_labels(eeg_labels, feature_type, np.shape(eeg_data)[1])
+
+    X_train, X_test, y_train, y_test = split_features(X_full, y)
+
+    input_shape = X_train.shape[1:]
+
+    return X_train, X_test, y_train, y_test, input_shape
+
+
+def compute_features(eeg_data, feature_type="SIS", out=None, chunk_size=32,
+                     dtype="float32"):
+    """
+    Builds the full feature tensor, one chunk of trials at a time.
+
+    Args:
+        eeg_data (np.ndarray): Raw EEG as returned by load_dataset
+        feature_type (str): 'SIS' or 'WSIS'
+        out (np.ndarray, optional): Preallocated (e.g. memory-mapped) destination
+        chunk_size (int): Number of trials transformed per chunk
+        dtype (str): Storage dtype of the features ('float32' or 'float16')
+
+    Returns:
+        np.ndarray: Features of shape feature_shape(eeg_data.shape, feature_type)
+    """
+    if out is None:
+        out = np.zeros(feature_shape(np.shape(eeg_data), feature_type), dtype=dtype)
+
+    start = 0
+    for X in iter_features(eeg_data, feature_type, chunk_size, dtype):
+        out[start:start + len(X)] = X
+        start += len(X)
+
+    return out
+
+
+def iter_features(eeg_data, feature_type="SIS", chunk_size=32, dtype="float32"):
+    """
+    Yields feature tensors for consecutive chunks of ``chunk_size`` trials,
+    so peak memory depends on the chunk size rather than the dataset size.
+
+    Spectrograms are computed and scaled in float64 and only then cast to
+    ``dtype``, so float32 features match what Keras used to downcast to.
+    """
+    feature_type = feature_type.upper()
+
+    if feature_type == "WSIS":
+        return _iter_wsis_features(eeg_data, chunk_size, dtype)
+
+    elif feature_type == "SIS":
+        return _iter_sis_features(eeg_data, chunk_size, dtype)
+
+    else:
+        raise ValueError("feature_type must be 'WSIS' or 'SIS'")
+
+
+def feature_shape(data_shape, feature_type="SIS"):
+
     feature_type = feature_type.upper()
+    f_size, t_size = spectrogram_size(data_shape[-1])
 
     if feature_type == "WSIS":
-        return _create_wsis_features(eeg_data, eeg_labels)
+        return (data_shape[0] * data_shape[1], f_size, t_size, 1)
 
     elif feature_type == "SIS":
-        return _create_sis_features(eeg_data, eeg_labels)
+        if len(data_shape) != 3 or data_shape[1] <= SIS_GATHER_INDEX.max():
+            raise ValueError(
+                f"SIS needs (trials, {SIS_GATHER_INDEX.max() + 1}, samples) EEG in the "
+                f"DENS electrode layout, got shape {tuple(data_shape)}"
+            )
+
+        n_windows = len(SIS_GATHER_INDEX) // 4
+        return (data_shape[0] * n_windows, f_size, t_size, 4)
 
     else:
         raise ValueError("feature_type must be 'WSIS' or 'SIS'")
 
 
+def windows_per_trial(feature_type="SIS", n_channels=128):
+    """
+    Feature rows per trial: consecutive rows ``k * n .. (k + 1) * n - 1``
+    of the feature tensor belong to trial ``k``.
+
+    Args:
+        feature_type (str): 'SIS' or 'WSIS'
+        n_channels (int): EEG channels per trial (WSIS only)
+    """
+    feature_type = feature_type.upper()
+
+    if feature_type == "WSIS":
+        # One row per channel
+        return n_channels
+
+    elif feature_type == "SIS":
+        # One row per spatial window (106 patches)
+        return len(SIS_GATHER_INDEX) // 4
 
-def _create_wsis_features(eeg_data, eeg_labels):
+    else:
+        raise ValueError("feature_type must be 'WSIS' or 'SIS'")
 
-    # Flatten subject dimension
-    eeg_data = _combine_dims(np.array(eeg_data), 0)
 
-    # Expand labels per channel (128 channels assumed)
-    expanded_labels = []
-    for label in eeg_labels:
-        for _ in range(128):
-            expanded_labels.append(label)
+def expand_labels(eeg_labels, feature_type="SIS", n_channels=128):
 
-    y = to_categorical(np.array(expanded_labels))
+    # Sparse integer class ids, one per feature row
+    return np.repeat(np.asarray(eeg_labels), windows_per_trial(feature_type, n_channels))
 
-    fs = 250
-    nperseg = 125
-    noverlap = 62
 
-    size_dataset = len(eeg_data)
-    f_size = math.ceil((nperseg + 1) / 2)
-    t_size = int((eeg_data[0].size - noverlap) / (nperseg - noverlap))
+def split_features(X_full, y):
 
-    X_full = np.zeros((size_dataset, f_size, t_size, 1))
+    train_idx, test_idx = split_indices(len(X_full))
 
-    for i in range(size_dataset):
-        X = eeg_data[i]
-        _, _, Sxx = spectrogram(X, fs, nperseg=nperseg,
-                                noverlap=noverlap, mode='psd')
-        X_full[i, :, :, 0] = Sxx
+    return X_full[train_idx], X_full[test_idx], y[train_idx], y[test_idx]
 
-    X_full /= 255.0
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_full, y, test_size=0.2, random_state=42
+def split_indices(n_samples):
+    """
+    Splits sample indices 80/20, returned as sorted (train_idx, test_idx).
+    """
+    train_idx, test_idx = train_test_split(
+        np.arange(n_samples), test_size=0.2, random_state=42
     )
 
-    input_shape = X_train.shape[1:]
+    return np.sort(train_idx), np.sort(test_idx)
 
-    return X_train, X_test, y_train, y_test, input_shape
 
+def subject_folds(groups, cv="loso", n_folds=5, val_size=0.2, seed=42):
+    """
+    Subject-aware cross-validation folds: no subject is in more than one of
+    the train, validation and test rows of a fold.
 
+    The validation rows are whole training subjects held back for early
+    stopping and checkpoint selection, so the test subjects are only used
+    for the final evaluation.
 
-def _create_sis_features(eeg_data, eeg_labels):
+    Args:
+        groups (np.ndarray): Subject id of every sample
+        cv (str): 'loso' (one fold per subject) or 'kfold' (``n_folds``
+            folds of whole subjects)
+        n_folds (int): Number of folds for 'kfold'
+        val_size (float): Fraction of a fold's training subjects used for
+            validation
+        seed (int): Seed of the validation subject draw
 
-    shuffled_ch = [128,32,25,21,127,17,126,14,8,2,1,
-                   125,48,43,38,33,26,22,15,9,10,3,
-                   123,122,44,39,34,28,27,23,18,16,
-                   121,114,120,119,24,19,11,4,124,117,
-                   116,115,110,109,108,113,40,35,29,
-                   20,12,5,118,111,93,104,103,98,41,
-                   36,30,7,13,6,112,105,102,101,100,
-                   107,49,56,45,46,47,42,37,31,97,96,
-                   95,99,57,50,57,58,55,106,80,87,79,
-                   86,92,91,52,53,54,61,62,72,78,77,85,
-                   84,90,94,63,64,59,60,66,67,71,76,82,
-                   83,89,88,68,65,69,70,73,74,75,81,129,
-                   129,129,129]
-    twoD = np.array(shuffled_ch).reshape(11,12)
+    Returns:
+        list: Sorted (train_idx, val_idx, test_idx) per fold
+    """
+    if cv == "loso":
+        splitter = LeaveOneGroupOut()
 
+    elif cv == "kfold":
+        splitter = GroupKFold(n_splits=n_folds)
 
-    eeg_data = np.array(eeg_data)
+    else:
+        raise ValueError("cv must be 'loso' or 'kfold'")
 
-    # Create spatial windows
-    stride_windows = _generate_spatial_windows(twoD)
+    folds = []
 
-    reshuffled = []
+    for train_idx, test_idx in splitter.split(np.zeros(len(groups)), groups=groups):
+        if len(np.unique(groups[train_idx])) < 2:
+            raise ValueError("Validation needs at least two training subjects per fold")
 
-    for sample in eeg_data:
-        temp_sample = []
-        for window in stride_windows:
-            for row in window:
-                for ch in row:
-                    temp_sample.append(sample[ch - 1])
-        reshuffled.append(temp_sample)
+        inner = GroupShuffleSplit(n_splits=1, test_size=val_size, random_state=seed)
+        fit_rows, val_rows = next(inner.split(train_idx, groups=groups[train_idx]))
 
-    reshuffled = np.array(reshuffled)
+        folds.append((
+            np.sort(train_idx[fit_rows]),
+            np.sort(train_idx[val_rows]),
+            np.sort(test_idx)
+        ))
 
-    # Expand labels (106 patches)
-    expanded_labels = []
-    for label in eeg_labels:
-        for _ in range(len(stride_windows)):
-            expanded_labels.append(label)
+    return folds
 
-    y = to_categorical(np.array(expanded_labels))
 
-    reshuffled = _combine_dims(reshuffled, 0)
+def load_split(split_path, n_samples, create=True):
+    """
+    Loads the persisted (train_idx, test_idx) of a run, creating it on first use.
 
-    fs = 250
-    nperseg = 125
-    noverlap = 62
+    Args:
+        split_path (str): Path of the .npz file holding the split
+        n_samples (int): Number of samples in the feature tensor
+        create (bool): Create a new split if none exists; otherwise a
+            missing split raises FileNotFoundError
 
-    new_size = len(reshuffled) // 4
-    f_size = math.ceil((nperseg + 1) / 2)
-    t_size = int((reshuffled[0].size - noverlap) / (nperseg - noverlap))
+    Returns:
+        tuple: (train_idx, test_idx)
+    """
+    if os.path.isfile(split_path):
+        split = np.load(split_path)
+        train_idx, test_idx = split["train_idx"], split["test_idx"]
 
-    X_full = np.zeros((new_size, f_size, t_size, 4))
+        # Cross-validation splits also hold validation rows
+        n_split = sum(len(split[name]) for name in split.files)
 
-    for i in range(new_size):
-        for j in range(4):
-            idx = i * 4 + j
-            _, _, Sxx = spectrogram(
-                reshuffled[idx],
-                fs,
-                nperseg=nperseg,
-                noverlap=noverlap,
-                mode='psd'
+        if n_split != n_samples:
+            raise ValueError(
+                f"Split in {split_path} covers {n_split} samples, features have {n_samples}"
             )
-            X_full[i, :, :, j] = Sxx
 
-    X_full /= 255.0
+        return train_idx, test_idx
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_full, y, test_size=0.2, random_state=42
-    )
+    if not create:
+        raise FileNotFoundError(f"No split found at {split_path}")
 
-    input_shape = X_train.shape[1:]
+    train_idx, test_idx = split_indices(n_samples)
 
-    return X_train, X_test, y_train, y_test, input_shape
+    os.makedirs(os.path.dirname(split_path) or ".", exist_ok=True)
+    np.savez(split_path, train_idx=train_idx, test_idx=test_idx)
+
+    return train_idx, test_idx
+
+
+
+def load_validation_split(split_path):
+    """
+    Validation rows of a persisted split, or None if it has none (the
+    random split validates on its test rows).
+    """
+    split = np.load(split_path)
+    return split["val_idx"] if "val_idx" in split.files else None
+
+
+def spectrogram_size(n_time):
+    """
+    (frequency, time) bins of the spectrogram of ``n_time`` samples.
+    """
+    f_size = math.ceil((NPERSEG + 1) / 2)
+    t_size = int((n_time - NOVERLAP) / (NPERSEG - NOVERLAP))
+
+    return f_size, t_size
+
+
+
+def _iter_wsis_features(eeg_data, chunk_size, dtype):
+
+    eeg_data = np.asarray(eeg_data)
+    f_size, t_size = spectrogram_size(eeg_data.shape[-1])
+
+    for start in range(0, len(eeg_data), chunk_size):
+        # Flatten subject dimension
+        rows = _combine_dims(eeg_data[start:start + chunk_size], 0)
+
+        X = np.zeros((len(rows), f_size, t_size, 1))
+
+        batched_spectrogram(rows, X[..., 0], FS, NPERSEG, NOVERLAP)
+
+        X /= 255.0
+
+        yield X.astype(dtype, copy=False)
+
+
+
+def _iter_sis_features(eeg_data, chunk_size, dtype):
+
+    eeg_data = np.asarray(eeg_data)
+    n_trials, n_channels, n_time = eeg_data.shape
+    f_size, t_size = spectrogram_size(n_time)
+
+    spec = np.empty((min(chunk_size, n_trials), n_channels, f_size, t_size))
+
+    for start in range(0, n_trials, chunk_size):
+        stop = min(start + chunk_size, n_trials)
+        chunk = spec[:stop - start]
+
+        batched_spectrogram(eeg_data[start:stop], chunk, FS, NPERSEG, NOVERLAP)
+        chunk /= 255.0
+
+        yield sis_windows(chunk, dtype)
+
+
+def sis_windows(spec, dtype):
+    """
+    Reshuffles per-electrode spectrograms (trials, channels, f, t) into SIS
+    windows (trials * windows, f, t, 4).
+    """
+    n_trials, _, f_size, t_size = spec.shape
+    n_windows = len(SIS_GATHER_INDEX) // 4
+
+    # Each electrode's spectrogram is computed once and then gathered into
+    # every (overlapping) window it belongs to
+    gathered = spec[:, SIS_GATHER_INDEX].reshape(
+        n_trials, n_windows, 4, f_size, t_size
+    )
+    X = np.ascontiguousarray(np.moveaxis(gathered, 2, -1), dtype=dtype)
+
+    return X.reshape(-1, f_size, t_size, 4)
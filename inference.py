@@ -0,0 +1,190 @@
+import argparse
+import os
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+
+from datasets.data_loader import map_files, read_deap_subject, read_dens_file
+from feature_creation import feature_shape, iter_features
+
+
+# =====================================
+# Predictor
+# =====================================
+
+class Predictor:
+    """
+    Loads a checkpoint once and scores raw EEG trials in large batches.
+
+    Trials go through the same SIS/WSIS feature path as training. Each
+    trial is scored per window (SIS patch or WSIS channel) and aggregated
+    into a trial-level prediction.
+    """
+
+    def __init__(self, checkpoint_path, feature_type="SIS", batch_size=1024,
+                 dtype="float32", chunk_size=32):
+        self.feature_type = feature_type.upper()
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+
+        self.model = load_model(checkpoint_path)
+        self.input_shape = tuple(self.model.input_shape[1:])
+        self.num_classes = self.model.output_shape[-1]
+
+        self._predict = tf.function(
+            lambda x: self.model(x, training=False),
+            reduce_retracing=True
+        )
+
+        # Warm up so the first real batch does not pay for tracing
+        self._predict(np.zeros((1,) + self.input_shape, dtype=self.dtype))
+
+    def predict_features(self, X):
+        """
+        Class probabilities for a feature tensor, in batches of batch_size.
+        """
+        probs = np.empty((len(X), self.num_classes), dtype=np.float32)
+
+        for start in range(0, len(X), self.batch_size):
+            batch = X[start:start + self.batch_size]
+            probs[start:start + len(batch)] = self._predict(batch).numpy()
+
+        return probs
+
+    def check_input(self, eeg_data):
+        """
+        Raises ValueError unless ``eeg_data`` is (trials, channels, samples)
+        EEG whose features match the model input.
+        """
+        if np.ndim(eeg_data) != 3:
+            raise ValueError(
+                f"Expected (trials, channels, samples) EEG, got shape {np.shape(eeg_data)}"
+            )
+
+        shape = feature_shape(np.shape(eeg_data), self.feature_type)
+        if shape[1:] != self.input_shape:
+            raise ValueError(
+                f"Features of shape {shape[1:]} do not match the model input "
+                f"{self.input_shape}"
+            )
+
+    def predict_trials(self, eeg_data):
+        """
+        Scores raw trials.
+
+        Args:
+            eeg_data (np.ndarray): (trials, channels, samples) raw EEG
+
+        Returns:
+            dict: ``window_probs`` (trials, windows, classes), ``trial_probs``
+            (mean over windows), ``trial_pred`` (argmax of trial_probs) and
+            ``trial_vote`` (majority vote of the window predictions)
+        """
+        eeg_data = np.asarray(eeg_data)
+        n_trials = len(eeg_data)
+
+        self.check_input(eeg_data)
+
+        probs = np.concatenate([
+            self.predict_features(X)
+            for X in iter_features(eeg_data, self.feature_type, self.chunk_size, self.dtype)
+        ])
+
+        window_probs = probs.reshape(n_trials, -1, self.num_classes)
+        trial_probs = window_probs.mean(axis=1)
+
+        window_pred = np.argmax(window_probs, axis=-1)
+        votes = np.apply_along_axis(
+            np.bincount, 1, window_pred, minlength=self.num_classes
+        )
+
+        return {
+            "window_probs": window_probs,
+            "trial_probs": trial_probs,
+            "trial_pred": np.argmax(trial_probs, axis=1),
+            "trial_vote": np.argmax(votes, axis=1)
+        }
+
+    def predict_files(self, paths, num_workers=1):
+        """
+        Scores DENS ``.mat`` recordings and DEAP ``sNN.dat`` subject files.
+
+        Files are decoded (optionally in parallel) while earlier ones are
+        being scored.
+
+        Returns:
+            dict: Outputs of predict_trials concatenated over all trials, plus
+            ``record`` (source file) and ``trial`` (index within the file)
+        """
+        results = []
+        records = []
+        trials = []
+
+        for path, eeg_data in zip(paths, map_files(read_recording, paths, num_workers)):
+            result = self.predict_trials(eeg_data)
+
+            results.append(result)
+            records.extend([os.path.basename(path)] * len(eeg_data))
+            trials.extend(range(len(eeg_data)))
+
+        merged = {
+            key: np.concatenate([result[key] for result in results])
+            for key in results[0]
+        }
+        merged["record"] = np.array(records)
+        merged["trial"] = np.array(trials)
+
+        return merged
+
+
+def read_recording(path):
+    """
+    Reads a raw recording as (trials, channels, samples).
+    """
+    if path.endswith(".mat"):
+        return read_dens_file(path)[None]
+
+    elif path.endswith(".dat"):
+        eeg_data, _ = read_deap_subject(path)
+        return eeg_data
+
+    else:
+        raise ValueError(f"Unsupported recording format: {path}")
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Score raw EEG recordings with a trained checkpoint"
+    )
+
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--inputs', nargs='+', required=True,
+                        help='.mat (DENS) or .dat (DEAP) recordings')
+    parser.add_argument('--output', default='predictions.npz')
+    parser.add_argument('--batch_size', type=int, default=1024)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--num_workers', type=int, default=1)
+
+    args = parser.parse_args()
+
+    predictor = Predictor(
+        args.checkpoint,
+        feature_type=args.feature_type,
+        batch_size=args.batch_size,
+        dtype=args.dtype
+    )
+
+    results = predictor.predict_files(args.inputs, num_workers=args.num_workers)
+    np.savez(args.output, **results)
+
+    for record, trial, pred in zip(results["record"], results["trial"], results["trial_pred"]):
+        print(f"{record}\t{trial}\t{pred}")
+
+    print("Predictions saved to:", args.output)
@@ -5,32 +5,50 @@ import tensorflow as tf
 import matplotlib.pyplot as plt
 from keras.models import load_model
 
+from datasets.data_loader import DATASET_CHANNELS
 from datasets.utils import LabelMapper
-from datasets.data_loader import load_dataset
-from feature_creation import create_features
+from feature_cache import CACHE_DIR, load_features
+from feature_creation import (
+    FS,
+    NPERSEG,
+    SIS_CHANNEL_MAP,
+    SIS_GATHER_INDEX,
+    SIS_WINDOW_POSITIONS,
+    load_split,
+    windows_per_trial
+)
+from main import get_checkpoint_path, get_results_dir
+from model import ARCHITECTURES, DEFAULT_ARCH
+from pipeline import make_dataset
 
 
 # =====================================
-# Path Utilities
+# Model Utilities
 # =====================================
 
-def get_checkpoint_path(args):
-    return os.path.join(
-        "checkpoints",
-        args.dataset_name,
-        args.feature_type,
-        f"{args.dataset_name}_{args.feature_type}_{args.task}_{args.num_classes}.h5"
-    )
+def conv_layer_names(model):
+    """
+    Names of the first two 2D convolution layers, which are visualised as
+    feature maps; Grad-CAM uses the second.
+    """
+    conv_types = (tf.keras.layers.Conv2D, tf.keras.layers.SeparableConv2D)
+    names = [layer.name for layer in model.layers if isinstance(layer, conv_types)]
 
+    return names[:2]
 
-def get_results_dir(args):
-    return os.path.join(
-        "results",
-        args.dataset_name,
-        args.feature_type,
-        args.task,
-        str(args.num_classes)
-    )
+
+# =====================================
+# Occlusion Settings
+# =====================================
+
+# Frequency bands (Hz) masked by occlusion; None means up to Nyquist
+EEG_BANDS = {
+    "delta": (0, 4),
+    "theta": (4, 8),
+    "alpha": (8, 13),
+    "beta": (13, 30),
+    "gamma": (30, None)
+}
 
 
 # =====================================
@@ -63,6 +81,56 @@ def save_gradcam_overlay(sample, heatmap, save_path, pred_class):
     plt.close()
 
 
+def save_class_heatmaps(heatmaps, counts, save_path, title):
+    num_classes = len(heatmaps)
+
+    plt.figure(figsize=(4 * num_classes, 4))
+    for i in range(num_classes):
+        plt.subplot(1, num_classes, i+1)
+        plt.imshow(heatmaps[i], aspect='auto', cmap='jet')
+        plt.axis('off')
+        plt.title(f'Class {i} (n={counts[i]})')
+    plt.suptitle(title)
+    plt.tight_layout()
+    plt.savefig(save_path)
+    plt.close()
+
+
+def save_scalp_heatmap(electrode_values, save_path, title):
+    # Electrodes are laid out on the 11x12 SIS channel map (129 = empty)
+    grid = np.full(SIS_CHANNEL_MAP.shape, np.nan)
+    occupied = SIS_CHANNEL_MAP != 129
+    grid[occupied] = electrode_values[SIS_CHANNEL_MAP[occupied] - 1]
+
+    plt.figure(figsize=(7, 6))
+    plt.imshow(grid, cmap='hot', interpolation='nearest')
+    for (i, j), ch in np.ndenumerate(SIS_CHANNEL_MAP):
+        if ch != 129:
+            plt.text(j, i, str(ch), ha='center', va='center', fontsize=6, color='cyan')
+    plt.colorbar(label='Mean drop in class probability')
+    plt.title(title)
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(save_path)
+    plt.close()
+
+
+def save_window_heatmap(window_values, save_path, title):
+    # Each SIS window is drawn at its top-left position on the channel map
+    rows, cols = SIS_CHANNEL_MAP.shape
+    grid = np.full((rows - 1, cols - 1), np.nan)
+    grid[SIS_WINDOW_POSITIONS[:, 0], SIS_WINDOW_POSITIONS[:, 1]] = window_values
+
+    plt.figure(figsize=(7, 6))
+    plt.imshow(grid, cmap='hot', interpolation='nearest')
+    plt.colorbar(label='Mean drop in class probability')
+    plt.title(title)
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(save_path)
+    plt.close()
+
+
 # =====================================
 # Grad-CAM
 # =====================================
@@ -90,6 +158,268 @@ def grad_cam(model, img, class_idx, layer_name):
     return heatmap
 
 
+def make_batched_attribution(model, layer_names, cam_layer):
+    """
+    Builds the attribution model once and returns a compiled function that
+    computes, for a batch, the feature maps of ``layer_names``, the Grad-CAM
+    heatmaps of ``cam_layer`` for each sample's predicted class, and the
+    predictions.
+    """
+    attribution_model = tf.keras.Model(
+        inputs=model.inputs,
+        outputs=[model.get_layer(name).output for name in layer_names]
+                + [model.get_layer(cam_layer).output, model.output]
+    )
+
+    @tf.function(reduce_retracing=True)
+    def attribute(images):
+        with tf.GradientTape() as tape:
+            *feature_maps, conv_outputs, predictions = attribution_model(
+                images, training=False
+            )
+            class_idx = tf.argmax(predictions, axis=1)
+            loss = tf.gather(predictions, class_idx, axis=1, batch_dims=1)
+
+        # Samples are independent in inference mode, so the gradient of the
+        # summed loss holds each sample's own gradient
+        grads = tape.gradient(loss, conv_outputs)
+
+        conv_outputs = tf.cast(conv_outputs, tf.float32)
+        pooled_grads = tf.reduce_mean(tf.cast(grads, tf.float32), axis=(1, 2), keepdims=True)
+
+        heatmaps = tf.nn.relu(tf.reduce_sum(conv_outputs * pooled_grads, axis=-1))
+        heatmaps /= tf.reduce_max(heatmaps, axis=(1, 2), keepdims=True) + 1e-8
+
+        feature_maps = [tf.cast(fmap, tf.float32) for fmap in feature_maps]
+
+        return feature_maps, heatmaps, predictions
+
+    return attribute
+
+
+def batched_attribution(model, dataset, num_classes, layer_names, cam_layer):
+    """
+    Runs Grad-CAM and feature-map extraction over a whole dataset.
+
+    Returns:
+        dict: Mean Grad-CAM heatmaps per predicted and per true class, mean
+        feature maps per true class, and the class counts
+    """
+    attribute = make_batched_attribution(model, layer_names, cam_layer)
+
+    sums = {}
+    counts = {
+        "pred": np.zeros(num_classes, dtype=np.int64),
+        "true": np.zeros(num_classes, dtype=np.int64)
+    }
+
+    def accumulate(key, values, classes):
+        if key not in sums:
+            sums[key] = np.zeros((num_classes,) + values.shape[1:])
+        np.add.at(sums[key], classes, values)
+
+    for images, labels in dataset:
+        feature_maps, heatmaps, predictions = attribute(images)
+
+        pred = np.argmax(predictions.numpy(), axis=1)
+        true = labels.numpy()
+
+        accumulate("gradcam_by_pred", heatmaps.numpy(), pred)
+        accumulate("gradcam_by_true", heatmaps.numpy(), true)
+
+        for name, fmap in zip(layer_names, feature_maps):
+            accumulate(f"{name}_by_true", fmap.numpy(), true)
+
+        counts["pred"] += np.bincount(pred, minlength=num_classes)
+        counts["true"] += np.bincount(true, minlength=num_classes)
+
+    results = {}
+    for key, total in sums.items():
+        key_counts = counts["pred"] if key.endswith("_by_pred") else counts["true"]
+        shape = (num_classes,) + (1,) * (total.ndim - 1)
+        results[key] = total / np.maximum(key_counts, 1).reshape(shape)
+
+    results["count_pred"] = counts["pred"]
+    results["count_true"] = counts["true"]
+
+    return results
+
+
+# =====================================
+# Occlusion Sensitivity
+# =====================================
+
+def make_occlusion_masks(input_shape):
+    """
+    Returns (masks, names): one multiplicative mask per EEG band and, for
+    SIS, one per input channel (the four electrodes of a window).
+
+    A WSIS row holds a single electrode, so masking its channel would blank
+    the whole input; WSIS electrodes are scored per row instead (see
+    aggregate_occlusion).
+    """
+    f_size, _, n_channels = input_shape
+    freqs = np.arange(f_size) * FS / NPERSEG
+
+    masks = []
+    names = []
+
+    for band, (low, high) in EEG_BANDS.items():
+        mask = np.ones(input_shape, dtype=np.float32)
+        selected = freqs >= low if high is None else (freqs >= low) & (freqs < high)
+        mask[selected] = 0
+        masks.append(mask)
+        names.append(band)
+
+    if n_channels > 1:
+        for c in range(n_channels):
+            mask = np.ones(input_shape, dtype=np.float32)
+            mask[..., c] = 0
+            masks.append(mask)
+            names.append(f"channel_{c}")
+
+    return np.stack(masks), names
+
+
+def occlusion_sensitivity(model, dataset, masks, base_probs=None):
+    """
+    Probability drop of each sample's predicted class under every mask.
+
+    All perturbations of a batch go through the model as one large batch.
+    ``base_probs`` (the unperturbed outputs, in dataset order) are reused
+    when given, so only the perturbed inputs need forward passes.
+
+    Returns:
+        tuple: (drops (N, P), base_probs (N, num_classes))
+    """
+    predict = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    masks = tf.constant(masks)
+    n_masks = masks.shape[0]
+
+    drops = []
+    all_probs = []
+    start = 0
+
+    for images, _ in dataset:
+        batch_size = images.shape[0]
+
+        if base_probs is None:
+            probs = predict(images).numpy()
+        else:
+            probs = base_probs[start:start + batch_size]
+        start += batch_size
+
+        perturbed = tf.cast(images[:, None], masks.dtype) * masks[None]
+        perturbed = tf.reshape(perturbed, (-1,) + tuple(images.shape[1:]))
+        perturbed_probs = predict(tf.cast(perturbed, images.dtype)).numpy()
+        perturbed_probs = perturbed_probs.reshape(batch_size, n_masks, -1)
+
+        pred = np.argmax(probs, axis=1)
+        rows = np.arange(batch_size)
+        drops.append(probs[rows, pred][:, None] - perturbed_probs[rows, :, pred])
+        all_probs.append(probs)
+
+    return np.concatenate(drops), np.concatenate(all_probs)
+
+
+def aggregate_occlusion(drops, sample_idx, n_bands, n_positions):
+    """
+    Maps per-sample drops back to positions and electrodes.
+
+    Rows are ordered trial-major over the ``n_positions`` rows of a trial
+    (windows_per_trial), so ``sample_idx % n_positions`` is the window (SIS)
+    or electrode (WSIS) of each sample.
+
+    SIS drops hold the band masks followed by the four channel masks; an
+    electrode averages every window channel it occupies. WSIS drops only
+    hold band masks, and an electrode's score is the mean band drop of its
+    rows.
+    """
+    n_channels = drops.shape[1] - n_bands
+
+    position = sample_idx % n_positions
+    counts = np.maximum(np.bincount(position, minlength=n_positions), 1)
+
+    band_drops = np.zeros((n_positions, n_bands))
+    np.add.at(band_drops, position, drops[:, :n_bands])
+    band_drops /= counts[:, None]
+
+    if n_channels == 0:
+        return {"position_band": band_drops, "electrode": band_drops.mean(axis=1)}
+
+    channel_drops = np.zeros((n_positions, n_channels))
+    np.add.at(channel_drops, position, drops[:, n_bands:])
+    channel_drops /= counts[:, None]
+
+    electrode_index = SIS_GATHER_INDEX.reshape(n_positions, n_channels)
+    n_electrodes = SIS_GATHER_INDEX.max() + 1
+
+    electrode_sum = np.zeros(n_electrodes)
+    electrode_count = np.zeros(n_electrodes)
+    np.add.at(electrode_sum, electrode_index.reshape(-1), channel_drops.reshape(-1))
+    np.add.at(electrode_count, electrode_index.reshape(-1), 1)
+
+    return {
+        "position_band": band_drops,
+        "position_channel": channel_drops,
+        "electrode": electrode_sum / np.maximum(electrode_count, 1)
+    }
+
+
+def _load_base_probs(path, checkpoint_path, test_idx):
+    # Cached unperturbed outputs are valid for the same split and checkpoint
+    if not os.path.isfile(path):
+        return None
+
+    if os.path.getmtime(path) < os.path.getmtime(checkpoint_path):
+        return None
+
+    cached = np.load(path)
+    if not np.array_equal(cached["indices"], test_idx):
+        return None
+
+    return cached["probs"]
+
+
+def run_occlusion(model, X_full, y, test_idx, result_dir, checkpoint_path, batch_size,
+                  dataset_name, feature_type):
+
+    masks, names = make_occlusion_masks(X_full.shape[1:])
+    n_bands = len(EEG_BANDS)
+    n_positions = windows_per_trial(feature_type, DATASET_CHANNELS[dataset_name])
+
+    base_path = os.path.join(result_dir, "occlusion_base.npz")
+    base_probs = _load_base_probs(base_path, checkpoint_path, test_idx)
+
+    test_data = make_dataset(X_full, y, test_idx, batch_size=batch_size)
+    drops, probs = occlusion_sensitivity(model, test_data, masks, base_probs)
+
+    if base_probs is None:
+        np.savez(base_path, probs=probs, indices=test_idx)
+
+    results = aggregate_occlusion(drops, test_idx, n_bands, n_positions)
+    np.savez(
+        os.path.join(result_dir, "occlusion.npz"),
+        mask_names=np.array(names),
+        **results
+    )
+
+    # The scalp plot uses the DENS electrode layout
+    if dataset_name == "DENS":
+        save_scalp_heatmap(
+            results["electrode"],
+            os.path.join(result_dir, "occlusion_electrodes.png"),
+            "Occlusion Sensitivity per Electrode"
+        )
+
+    if "position_channel" in results:
+        save_window_heatmap(
+            results["position_channel"].mean(axis=1),
+            os.path.join(result_dir, "occlusion_windows.png"),
+            "Occlusion Sensitivity per SIS Window"
+        )
+
+
 # =====================================
 # Main
 # =====================================
@@ -102,22 +432,27 @@ def main(args):
     checkpoint_path = get_checkpoint_path(args)
     saved_model = load_model(checkpoint_path)
 
-    # Reload dataset & features
+    # Reload dataset & features (cached by training)
     label_mapper = LabelMapper(args.task, args.num_classes)
-    data, labels = load_dataset(args.dataset_name, label_mapper)
-
-    X_train, X_test, y_train, y_test, _ = create_features(
-        data,
-        labels,
-        feature_type=args.feature_type
+    X_full, y = load_features(
+        args.dataset_name,
+        label_mapper,
+        feature_type=args.feature_type,
+        cache_dir=args.cache_dir,
+        dtype=args.dtype,
+        num_workers=args.num_workers
     )
 
+    # Reuse the split persisted by training
+    result_dir = get_results_dir(args)
+    _, test_idx = load_split(os.path.join(result_dir, "split.npz"), len(X_full))
+
     # Select sample
     sample_idx = 0
-    sample = X_test[sample_idx:sample_idx+1]
+    sample = np.array(X_full[test_idx[sample_idx:sample_idx+1]])
 
     # Feature Map Extraction
-    layer_names = ['conv2d', 'conv2d_1']
+    layer_names = conv_layer_names(saved_model)
 
     feature_model = tf.keras.Model(
         inputs=saved_model.input,
@@ -126,8 +461,6 @@ def main(args):
 
     feature_maps = feature_model.predict(sample)
 
-    result_dir = get_results_dir(args)
-
     save_feature_maps(
         feature_maps[0],
         os.path.join(result_dir, "feature_maps_layer1.png"),
@@ -147,7 +480,7 @@ def main(args):
         saved_model,
         sample,
         pred_class,
-        layer_name='conv2d_1'
+        layer_name=layer_names[1]
     )
 
     save_gradcam_overlay(
@@ -157,6 +490,48 @@ def main(args):
         pred_class
     )
 
+    # Class-level attribution over the whole test set
+    if args.batched:
+        num_classes = saved_model.output_shape[-1]
+        test_data = make_dataset(X_full, y, test_idx, batch_size=args.batch_size)
+
+        results = batched_attribution(
+            saved_model,
+            test_data,
+            num_classes,
+            layer_names,
+            cam_layer=layer_names[1]
+        )
+
+        np.savez(os.path.join(result_dir, "attribution.npz"), **results)
+
+        save_class_heatmaps(
+            results["gradcam_by_pred"],
+            results["count_pred"],
+            os.path.join(result_dir, "gradcam_by_pred.png"),
+            "Mean Grad-CAM per Predicted Class"
+        )
+
+        save_class_heatmaps(
+            results["gradcam_by_true"],
+            results["count_true"],
+            os.path.join(result_dir, "gradcam_by_true.png"),
+            "Mean Grad-CAM per True Class"
+        )
+
+    if args.occlusion:
+        run_occlusion(
+            saved_model,
+            X_full,
+            y,
+            test_idx,
+            result_dir,
+            checkpoint_path,
+            batch_size=args.occlusion_batch_size,
+            dataset_name=args.dataset_name,
+            feature_type=args.feature_type
+        )
+
     print("Interpretability results saved to:", result_dir)
 
 
@@ -168,10 +543,27 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('--dataset_name', required=True)
+    parser.add_argument('--dataset_name', choices=['DEAP', 'DENS'], required=True)
     parser.add_argument('--task', required=True)
     parser.add_argument('--num_classes', type=int, required=True)
-    parser.add_argument('--feature_type', required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--arch', choices=ARCHITECTURES, default=DEFAULT_ARCH)
+    parser.add_argument('--cv', choices=['loso', 'kfold'], default=None,
+                        help='Cross-validation protocol of the run to explain')
+    parser.add_argument('--folds', type=int, default=5,
+                        help='Number of folds for --cv kfold')
+    parser.add_argument('--fold', type=int, default=None,
+                        help='Fold of --cv to explain')
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--batched', action='store_true',
+                        help='Also aggregate Grad-CAM and feature maps over the whole test set')
+    parser.add_argument('--batch_size', type=int, default=512)
+    parser.add_argument('--occlusion', action='store_true',
+                        help='Occlusion sensitivity per frequency band, SIS window and electrode')
+    parser.add_argument('--occlusion_batch_size', type=int, default=64,
+                        help='Samples per step; each is expanded to one input per mask')
 
     args = parser.parse_args()
 
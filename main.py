@@ -1,5 +1,6 @@
 import argparse
 import os
+from contextlib import nullcontext
 import numpy as np
 import tensorflow as tf
 import keras
@@ -8,10 +9,16 @@ from matplotlib import pyplot as plt
 from sklearn.utils.class_weight import compute_class_weight
 from sklearn.metrics import ConfusionMatrixDisplay
 
+from cross_validation import cv_name
+from datasets.data_loader import DATASET_CHANNELS
 from datasets.utils import LabelMapper
-from datasets.data_loader import load_dataset
-from feature_creation import create_features
-from model import build_model
+from distributed import distribute_dataset, is_worker, make_strategy, run_distributed
+from evaluation import evaluate_model, format_metrics
+from feature_cache import CACHE_DIR, load_features
+from feature_creation import load_split, load_validation_split
+from model import ARCHITECTURES, DEFAULT_ARCH, build_model, format_report, model_report
+from pipeline import make_dataset
+from profiling import StageProfiler
 
 import csv
 from datetime import datetime
@@ -32,7 +39,16 @@ def get_checkpoint_path(args):
 
     os.makedirs(feature_dir, exist_ok=True)
 
-    filename = f"{args.dataset_name}_{args.feature_type}_{args.task}_{args.num_classes}.h5"
+    filename = f"{args.dataset_name}_{args.feature_type}_{args.task}_{args.num_classes}"
+
+    # Paper-model checkpoints keep their original names
+    if args.arch != DEFAULT_ARCH:
+        filename += f"_{args.arch}"
+
+    if cv_name(args) is not None and args.fold is not None:
+        filename += f"_{cv_name(args)}_fold{args.fold:02d}"
+
+    filename += ".h5"
 
     return os.path.join(feature_dir, filename)
 
@@ -46,10 +62,38 @@ def get_results_dir(args):
         str(args.num_classes)
     )
 
+    if args.arch != DEFAULT_ARCH:
+        result_dir = os.path.join(result_dir, args.arch)
+
+    # Cross-validation summaries go to cv_<name>/, each fold to a subdirectory
+    if cv_name(args) is not None:
+        result_dir = os.path.join(result_dir, f"cv_{cv_name(args)}")
+
+        if args.fold is not None:
+            result_dir = os.path.join(result_dir, f"fold_{args.fold:02d}")
+
     os.makedirs(result_dir, exist_ok=True)
     return result_dir
 
 
+def get_tf_cache(args, split):
+    """
+    Cache argument of make_dataset for ``--tf_cache``: None, in memory ("")
+    or files in the run's results directory.
+    """
+    if args.tf_cache is None:
+        return None
+
+    if args.tf_cache == "memory":
+        return ""
+
+    cache_dir = os.path.join(get_results_dir(args), "tf_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Keyed by dtype; delete the directory after rebuilding the features
+    return os.path.join(cache_dir, f"{split}_{args.dtype}")
+
+
 def save_training_plots(history, args):
     result_dir = get_results_dir(args)
 
@@ -96,34 +140,100 @@ def save_confusion_matrix(y_test, y_pred, args):
 
 
 
-def log_experiment(args, test_acc):
+LOG_PATH = os.path.join("results", "experiment_log.csv")
 
-    log_path = os.path.join("results", "experiment_log.csv")
-    os.makedirs("results", exist_ok=True)
+LOG_HEADER = [
+    "Dataset",
+    "FeatureType",
+    "Task",
+    "NumClasses",
+    "TestAccuracy",
+    "Timestamp",
+    "LoadSeconds",
+    "FeatureSeconds",
+    "FitSeconds",
+    "EvalSeconds",
+    "SamplesPerSec",
+    "PeakRSSMB",
+    "Arch",
+    "Params",
+    "MFLOPs",
+    "MacroF1",
+    "TrialAccuracy",
+    "CV",
+    "Fold",
+    "Workers"
+]
 
-    file_exists = os.path.isfile(log_path)
 
-    with open(log_path, mode='a', newline='') as file:
-        writer = csv.writer(file)
+def init_experiment_log(log_path=LOG_PATH):
+    # Concurrent runs (sweep.py) create the header up front, so that each
+    # of them only appends a single row
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    if not os.path.isfile(log_path):
+        with open(log_path, mode='w', newline='') as file:
+            csv.writer(file).writerow(LOG_HEADER)
+        return
+
+    with open(log_path, newline='') as file:
+        rows = list(csv.reader(file))
+
+    # Logs written before columns were added get the new header; their
+    # rows are padded with empty cells
+    if rows and rows[0] != LOG_HEADER and rows[0] == LOG_HEADER[:len(rows[0])]:
+        with open(log_path, mode='w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(LOG_HEADER)
+
+            for row in rows[1:]:
+                writer.writerow(row + [""] * (len(LOG_HEADER) - len(row)))
 
-        # Write header only once
-        if not file_exists:
-            writer.writerow([
-                "Dataset",
-                "FeatureType",
-                "Task",
-                "NumClasses",
-                "TestAccuracy",
-                "Timestamp"
-            ])
+
+def _stage_seconds(profiler, name):
+    stage = profiler.stages.get(name)
+    return "" if stage is None else round(stage["wall_s"], 2)
+
+
+def _load_seconds(profiler):
+    # load_features also covers create_features on a cache miss, so the
+    # raw load is logged on its own when it ran
+    if "load_dataset" in profiler.stages:
+        return _stage_seconds(profiler, "load_dataset")
+
+    return _stage_seconds(profiler, "load_features")
+
+
+def log_experiment(args, metrics, profiler, report):
+
+    init_experiment_log()
+
+    samples_per_sec = profiler.samples_per_sec()
+
+    with open(LOG_PATH, mode='a', newline='') as file:
+        writer = csv.writer(file)
 
         writer.writerow([
             args.dataset_name,
             args.feature_type,
             args.task,
             args.num_classes,
-            round(float(test_acc), 5),
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            round(metrics["accuracy"], 5),
+            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            _load_seconds(profiler),
+            _stage_seconds(profiler, "create_features"),
+            _stage_seconds(profiler, "fit"),
+            _stage_seconds(profiler, "evaluate"),
+            "" if samples_per_sec is None else round(samples_per_sec, 1),
+            round(profiler.peak_rss_mb(), 1),
+            args.arch,
+            report["params"],
+            round(report["flops"] / 1e6, 2),
+            round(metrics["macro_f1"], 5),
+            round(metrics["trial_accuracy_vote"], 5),
+            cv_name(args) or "",
+            "" if cv_name(args) is None else args.fold,
+            args.distributed_workers
         ])
 
 
@@ -134,42 +244,154 @@ def log_experiment(args, test_acc):
 
 def main(args):
 
+    if args.cv is None and args.fold is not None:
+        raise ValueError("--fold requires --cv")
+
+    if args.cv is not None and args.fold is None:
+        # Every fold runs this function again, in its own process
+        from cross_validation import run_cv
+        return run_cv(args)
+
+    if args.cv is not None and args.distributed_workers > 1:
+        raise ValueError("--cv and --distributed_workers cannot be combined")
+
+    strategy, is_chief = None, True
+
+    if args.distributed_workers > 1:
+        if not is_worker():
+            # Every worker runs this function again, in its own process
+            return run_distributed(args)
+
+        # Created before any other TensorFlow op, as the strategy requires
+        strategy, is_chief = make_strategy()
+
     print("Running experiment with config:")
     print(args)
 
+    profiler = StageProfiler(cprofile=args.profile)
+    profiler.start()
+
     # Label mapping
     label_mapper = LabelMapper(
         mode=args.task,
         num_classes=args.num_classes
     )
 
-    # Load dataset
-    data, labels = load_dataset(args.dataset_name, label_mapper)
-    print("Loading data and labels, it will take some time...")
+    # Load dataset & features (cached after the first run)
+    with profiler.stage("load_features"):
+        X_full, y = load_features(
+            args.dataset_name,
+            label_mapper,
+            feature_type=args.feature_type,
+            cache_dir=args.cache_dir,
+            chunk_size=args.chunk_size,
+            dtype=args.dtype,
+            num_workers=args.num_workers,
+            profiler=profiler
+        )
 
-    X_train, X_test, y_train, y_test, input_shape = create_features(
-        data,
-        labels,
-        feature_type=args.feature_type
-    )
+        if not args.stream:
+            # Read the memory-mapped features into RAM once
+            X_full = np.array(X_full)
+
+    # The split is persisted as index arrays and applied lazily by the
+    # input pipeline, which gathers batches from X_full on demand
+    split_path = os.path.join(get_results_dir(args), "split.npz")
+
+    if args.fold is not None and not os.path.isfile(split_path):
+        # A single fold run on its own writes the subject splits first
+        from cross_validation import prepare_folds
+        prepare_folds(args)
+
+    train_idx, test_idx = load_split(split_path, len(X_full))
+
+    # Folds of --cv validate on held-back training subjects, so the test
+    # subjects never choose the epoch or the checkpoint
+    val_idx = load_validation_split(split_path)
 
-    # Build model
-    model = build_model(input_shape, args.num_classes)
+    y_train, y_test = y[train_idx], y[test_idx]
 
     # Compute class weights dynamically
-    y_train_labels = np.argmax(y_train, axis=1)
-    classes = np.unique(y_train_labels)
+    classes = np.unique(y_train)
 
     weights = compute_class_weight(
         class_weight='balanced',
         classes=classes,
-        y=y_train_labels
+        y=y_train
     )
 
     class_weights = dict(zip(classes, weights))
 
     print("Class Weights:", class_weights)
 
+    test_data = make_dataset(
+        X_full, y, test_idx,
+        batch_size=256,
+        cache=get_tf_cache(args, "test")
+    )
+
+    # Class weights are applied as per-sample weights by the pipeline
+    if strategy is None:
+        train_data = make_dataset(
+            X_full, y, train_idx,
+            batch_size=256,
+            shuffle=True,
+            class_weight=class_weights,
+            cache=get_tf_cache(args, "train")
+        )
+        fit_steps = {}
+
+        if val_idx is None:
+            val_data = test_data
+        else:
+            val_data = make_dataset(
+                X_full, y, val_idx,
+                batch_size=256,
+                cache=get_tf_cache(args, "val")
+            )
+
+    else:
+        # Every worker trains and validates on its own shard of the split
+        train_data, train_steps = distribute_dataset(
+            strategy, X_full, y, train_idx,
+            batch_size=256,
+            shuffle=True,
+            class_weight=class_weights,
+            cache=get_tf_cache(args, "train")
+        )
+        val_data, val_steps = distribute_dataset(
+            strategy, X_full, y, test_idx if val_idx is None else val_idx,
+            batch_size=256,
+            cache=get_tf_cache(args, "test")
+        )
+        fit_steps = {"steps_per_epoch": train_steps, "validation_steps": val_steps}
+
+    input_shape = X_full.shape[1:]
+
+    # Build and compile model; distributed, its variables are mirrored on
+    # every worker
+    with nullcontext() if strategy is None else strategy.scope():
+        model = build_model(
+            input_shape,
+            args.num_classes,
+            mixed_precision=args.mixed_precision,
+            arch=args.arch
+        )
+
+        optimizer = tf.keras.optimizers.Adam()
+        if args.mixed_precision:
+            # Dynamic loss scaling keeps float16 gradients from underflowing
+            optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+        model.compile(
+            optimizer=optimizer,
+            loss=keras.losses.sparse_categorical_crossentropy,
+            metrics=['accuracy']
+        )
+
+    report = model_report(model)
+    print(format_report(args.arch, report))
+
     # Setup callbacks
     checkpoint_path = get_checkpoint_path(args)
 
@@ -188,56 +410,101 @@ def main(args):
         save_best_only=True
     )
 
-    # Compile
-    model.compile(
-        optimizer="Adam",
-        loss=keras.losses.categorical_crossentropy,
-        metrics=['accuracy']
-    )
-
     # 8️⃣ Train
-    history = model.fit(
-        X_train,
-        y_train,
-        epochs=300,
-        batch_size=256,
-        verbose=1,
-        validation_data=(X_test, y_test),
-        class_weight=class_weights,
-        callbacks=[es, mc]
-    )
+    with profiler.stage("fit"):
+        history = model.fit(
+            train_data,
+            epochs=300,
+            verbose=1,
+            validation_data=val_data,
+            callbacks=[es, mc, profiler.callback(len(train_idx))],
+            **fit_steps
+        )
+
+    if not is_chief:
+        # Only the chief evaluates and logs; Keras already keeps the other
+        # workers' checkpoints in temporary files
+        profiler.stop()
+        return None
+
+    with profiler.stage("evaluate"):
+        # Load best model
+        saved_model = load_model(checkpoint_path)
+
+        # One prediction pass gives every metric; raw outputs are saved
+        metrics, y_test, y_pred = evaluate_model(
+            saved_model,
+            test_data,
+            test_idx,
+            args.feature_type,
+            args.num_classes,
+            get_results_dir(args),
+            DATASET_CHANNELS[args.dataset_name]
+        )
+        test_acc = metrics["accuracy"]
 
-    # Load best model
-    saved_model = load_model(checkpoint_path)
+        print("Test Accuracy:", test_acc)
+        print(format_metrics(metrics))
 
-    #Evaluate
-    _, test_acc = saved_model.evaluate(X_test, y_test, verbose=0)
-    print("Test Accuracy:", test_acc)
+    profiler.stop()
 
     # Saving log
-    log_experiment(args, test_acc)
+    log_experiment(args, metrics, profiler, report)
+    profiler.save(get_results_dir(args), config=vars(args), model=report)
 
     # Save plots
     save_training_plots(history, args)
 
-    y_pred = saved_model.predict(X_test)
-    y_pred = np.argmax(y_pred, axis=1)
-    y_test_labels = np.argmax(y_test, axis=1)
-
-    save_confusion_matrix(y_test_labels, y_pred, args)
+    save_confusion_matrix(y_test, y_pred, args)
 
+    return test_acc
 
 
-
-if __name__ == "__main__":
-
+def build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--dataset_name', choices=['DEAP', 'DENS'], required=True)
     parser.add_argument('--task', choices=['A', 'V', 'VAD'], required=True)
     parser.add_argument('--num_classes', type=int, required=True)
     parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--arch', choices=ARCHITECTURES, default=DEFAULT_ARCH,
+                        help='Model architecture (see model.py)')
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    parser.add_argument('--stream', action='store_true',
+                        help='Train from the memory-mapped feature cache instead of loading it into RAM')
+    parser.add_argument('--chunk_size', type=int, default=32,
+                        help='Trials transformed per chunk while building features')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32',
+                        help='Storage dtype of the cached features')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Processes decoding raw dataset files in parallel')
+    parser.add_argument('--mixed_precision', action='store_true',
+                        help='Train with the Keras mixed_float16 policy (fast on recent GPUs only)')
+    parser.add_argument('--tf_cache', choices=['memory', 'disk'], default=None,
+                        help='Cache the gathered input batches after the first epoch')
+    parser.add_argument('--profile', action='store_true',
+                        help='Also dump a cProfile of the run to profile.prof in the results directory')
+    parser.add_argument('--cv', choices=['loso', 'kfold'], default=None,
+                        help='Subject-aware cross-validation instead of the random window split')
+    parser.add_argument('--folds', type=int, default=5,
+                        help='Number of folds for --cv kfold')
+    parser.add_argument('--cv_workers', type=int, default=1,
+                        help='Folds trained concurrently')
+    parser.add_argument('--threads_per_fold', type=int, default=None,
+                        help='TensorFlow / BLAS threads per fold (default: cores / cv_workers)')
+    parser.add_argument('--fold', type=int, default=None,
+                        help='Train a single fold of --cv (the splits are written by a full --cv run)')
+    parser.add_argument('--distributed_workers', type=int, default=1,
+                        help='Train data-parallel on this many local worker processes (MultiWorkerMirroredStrategy)')
+    parser.add_argument('--threads_per_worker', type=int, default=None,
+                        help='TensorFlow / BLAS threads per distributed worker (default: cores / workers)')
+
+    return parser
 
-    args = parser.parse_args()
+
+if __name__ == "__main__":
+
+    args = build_parser().parse_args()
 
     main(args)
+
@@ -1,26 +1,86 @@
+import argparse
+import time
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import (
+    Conv1D,
     Conv2D,
+    DepthwiseConv2D,
+    SeparableConv2D,
     MaxPooling2D,
+    GlobalAveragePooling1D,
+    GlobalAveragePooling2D,
     Dropout,
     Flatten,
+    Permute,
+    Reshape,
     RepeatVector,
+    GRU,
     LSTM,
     Dense
 )
 
-def build_model(input_shape, num_classes):
+
+ARCHITECTURES = ("cnn_lstm", "ds_cnn", "cnn_gru", "cnn_tcn")
+
+DEFAULT_ARCH = "cnn_lstm"
+
+
+def build_model(input_shape, num_classes, mixed_precision=False, arch=DEFAULT_ARCH):
     """
-    Builds and returns the CNN-LSTM model used for DEAP SW A 3.
-    
+    Builds and returns the classifier.
+
     Args:
         input_shape (tuple): Shape of input (H, W, C)
         num_classes (int): Number of output classes
-        
+        mixed_precision (bool): Compute in float16 with float32 variables
+        arch (str): One of ARCHITECTURES
+            - 'cnn_lstm': the CNN-LSTM used for the paper results
+            - 'ds_cnn': depthwise-separable CNN with global average pooling
+            - 'cnn_gru': frequency-pooled conv front-end with a GRU over time
+            - 'cnn_tcn': the same front-end with dilated temporal convolutions
+
     Returns:
         tf.keras.Model
     """
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture {arch}, expected one of {ARCHITECTURES}")
+
+    # Layers take their dtype policy from the global policy when they are
+    # created, so it only has to be set while building
+    previous_policy = tf.keras.mixed_precision.global_policy()
+
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy("mixed_float16")
+
+    try:
+        if arch == "cnn_lstm":
+            model = _cnn_lstm(input_shape)
+
+        elif arch == "ds_cnn":
+            model = _ds_cnn(input_shape)
+
+        else:
+            model = _conv_sequence(input_shape, head=arch[4:])
+
+        # Softmax stays in float32 for numerically stable losses
+        model.add(Dense(num_classes, activation="softmax", dtype="float32"))
+
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous_policy)
+
+    return model
+
+
+# =====================================
+# Architectures
+# =====================================
+
+def _cnn_lstm(input_shape):
+    """
+    The CNN-LSTM used for DEAP SW A 3.
+    """
     model = Sequential()
 
     model.add(Conv2D(
@@ -48,6 +108,177 @@ def build_model(input_shape, num_classes):
     model.add(Dense(64, activation="relu"))
     model.add(Dropout(0.2))
 
-    model.add(Dense(num_classes, activation="softmax"))
+    return model
+
+
+def _ds_cnn(input_shape):
+    """
+    Depthwise-separable CNN. Global pooling replaces Flatten, so the head
+    no longer grows with the spectrogram size.
+    """
+    model = Sequential()
+
+    model.add(Conv2D(
+        32, (3, 3),
+        padding='same',
+        activation='relu',
+        input_shape=input_shape
+    ))
+    model.add(MaxPooling2D((2, 2), padding='same'))
+
+    model.add(SeparableConv2D(64, (3, 3), padding='same', activation='relu'))
+    model.add(MaxPooling2D((2, 2), padding='same'))
+
+    model.add(SeparableConv2D(128, (3, 3), padding='same', activation='relu'))
+
+    model.add(GlobalAveragePooling2D())
+    model.add(Dropout(0.2))
 
     return model
+
+
+def _conv_sequence(input_shape, head):
+    """
+    Conv front-end that pools frequency only, then a GRU or a dilated
+    temporal-conv stack over the spectrogram time frames.
+    """
+    model = Sequential()
+
+    model.add(Conv2D(
+        32, (3, 3),
+        padding='same',
+        activation='relu',
+        input_shape=input_shape
+    ))
+    model.add(MaxPooling2D((2, 1)))
+
+    model.add(Conv2D(64, (3, 3), padding='same', activation='relu'))
+    model.add(MaxPooling2D((2, 1)))
+    model.add(Dropout(0.1))
+
+    # (f, t, c) -> (t, f * c): one feature vector per time frame
+    f_size, t_size, channels = model.output_shape[1:]
+    model.add(Permute((2, 1, 3)))
+    model.add(Reshape((t_size, f_size * channels)))
+
+    if head == "gru":
+        model.add(GRU(64))
+
+    else:
+        for dilation in (1, 2, 4):
+            model.add(Conv1D(
+                64, 3,
+                padding='causal',
+                dilation_rate=dilation,
+                activation='relu'
+            ))
+        model.add(GlobalAveragePooling1D())
+
+    model.add(Dropout(0.2))
+
+    return model
+
+
+# =====================================
+# Cost Report
+# =====================================
+
+def estimate_flops(model):
+    """
+    Estimated FLOPs of one forward pass of one sample (2 per multiply-add).
+
+    Counts convolutions, dense and recurrent layers, which dominate the
+    cost; pooling, activations and reshapes are ignored.
+    """
+    flops = 0
+
+    for layer in model.layers:
+        in_shape = layer.input_shape[1:]
+        out_shape = layer.output_shape[1:]
+        out_positions = int(np.prod(out_shape[:-1]))
+
+        if isinstance(layer, SeparableConv2D):
+            kh, kw = layer.kernel_size
+            channels = in_shape[-1] * layer.depth_multiplier
+            flops += 2 * out_positions * (kh * kw * channels + channels * out_shape[-1])
+
+        elif isinstance(layer, DepthwiseConv2D):
+            kh, kw = layer.kernel_size
+            flops += 2 * out_positions * kh * kw * out_shape[-1]
+
+        elif isinstance(layer, (Conv1D, Conv2D)):
+            kernel = int(np.prod(layer.kernel_size))
+            flops += 2 * out_positions * kernel * in_shape[-1] * out_shape[-1]
+
+        elif isinstance(layer, Dense):
+            flops += 2 * int(np.prod(in_shape[:-1])) * in_shape[-1] * out_shape[-1]
+
+        elif isinstance(layer, (LSTM, GRU)):
+            gates = 4 if isinstance(layer, LSTM) else 3
+            steps, features = in_shape
+            flops += 2 * steps * gates * (features + layer.units) * layer.units
+
+    return flops
+
+
+def measure_latency(model, batch_size=1, runs=50):
+    """
+    Median CPU inference latency of one batch, in milliseconds.
+    """
+    with tf.device("/CPU:0"):
+        predict = tf.function(lambda x: model(x, training=False))
+        x = tf.zeros((batch_size,) + tuple(model.input_shape[1:]))
+
+        # Warm-up traces the function
+        predict(x)
+
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            predict(x).numpy()
+            times.append(time.perf_counter() - start)
+
+    return float(np.median(times) * 1000)
+
+
+def model_report(model, batch_size=1, runs=50):
+    """
+    Parameter count, estimated FLOPs per sample and measured CPU latency.
+    """
+    return {
+        "params": int(model.count_params()),
+        "flops": int(estimate_flops(model)),
+        "latency_ms": measure_latency(model, batch_size, runs),
+        "latency_batch_size": batch_size
+    }
+
+
+def format_report(arch, report):
+    return (
+        f"{arch}: {report['params']:,} params, "
+        f"{report['flops'] / 1e6:.1f} MFLOPs/sample, "
+        f"{report['latency_ms']:.2f} ms CPU latency (batch {report['latency_batch_size']})"
+    )
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Compare the cost of the available architectures"
+    )
+
+    parser.add_argument('--input_shape', type=int, nargs=3, default=[63, 19, 4],
+                        help='Feature shape (f, t, c); default is SIS on 5 s trials')
+    parser.add_argument('--num_classes', type=int, default=2)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=50)
+
+    args = parser.parse_args()
+
+    for arch in ARCHITECTURES:
+        model = build_model(tuple(args.input_shape), args.num_classes, arch=arch)
+        print(format_report(arch, model_report(model, args.batch_size, args.runs)))
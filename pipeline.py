@@ -0,0 +1,100 @@
+import numpy as np
+import tensorflow as tf
+
+
+# =====================================
+# tf.data Input Pipeline
+# =====================================
+
+def make_dataset(X, y, indices, batch_size=256, shuffle=False, seed=42,
+                 class_weight=None, shuffle_buffer=None,
+                 num_parallel_calls=tf.data.AUTOTUNE, cache=None):
+    """
+    Builds a tf.data.Dataset that gathers batches of ``X[indices]`` on demand.
+
+    Only the row indices go through shuffle and batch; the rows themselves
+    are gathered by a parallel map, so batch assembly overlaps with training
+    and, with prefetch, with each other. ``X`` and ``y`` may be
+    memory-mapped, in which case only the batches in flight are resident.
+    Batches keep the storage dtype of ``X``; the model casts them on input.
+
+    Args:
+        X (np.ndarray): Feature tensor (N, H, W, C)
+        y (np.ndarray): Labels aligned with X
+        indices (np.ndarray): Rows of X/y that make up this dataset
+        batch_size (int): Batch size
+        shuffle (bool): Reshuffle the rows every epoch
+        seed (int): Seed of the shuffling order
+        class_weight (dict, optional): {class: weight}; batches then carry
+            per-sample weights as a third element
+        shuffle_buffer (int, optional): Shuffle buffer in rows (default: all
+            rows, i.e. a full permutation per epoch)
+        num_parallel_calls (int): Batches gathered in parallel
+        cache (str, optional): Cache the gathered batches in memory ("") or
+            in files with this prefix. Batch composition is then drawn once
+            from ``seed`` and only the batch order is reshuffled per epoch.
+
+    Returns:
+        tf.data.Dataset
+    """
+    indices = np.asarray(indices)
+
+    weight_table = None
+    if class_weight is not None:
+        weight_table = np.zeros(max(class_weight) + 1, dtype=np.float32)
+        for label, weight in class_weight.items():
+            weight_table[label] = weight
+
+    def gather(batch):
+        # Sorted rows turn the gather into mostly sequential reads
+        batch = np.sort(batch)
+        X_batch, y_batch = X[batch], y[batch]
+
+        if weight_table is None:
+            return X_batch, y_batch
+
+        return X_batch, y_batch, weight_table[y_batch]
+
+    specs = [
+        tf.TensorSpec(shape=(None,) + X.shape[1:], dtype=X.dtype),
+        tf.TensorSpec(shape=(None,) + y.shape[1:], dtype=y.dtype)
+    ]
+    if weight_table is not None:
+        specs.append(tf.TensorSpec(shape=(None,), dtype=tf.float32))
+
+    def gather_batch(batch):
+        outputs = tf.numpy_function(gather, [batch], [spec.dtype for spec in specs])
+
+        for output, spec in zip(outputs, specs):
+            output.set_shape(spec.shape)
+
+        return tuple(outputs)
+
+    if shuffle and cache is not None:
+        # Cached batches cannot be recomposed, so draw them once
+        indices = np.random.default_rng(seed).permutation(indices)
+
+    dataset = tf.data.Dataset.from_tensor_slices(indices)
+
+    if shuffle and cache is None:
+        dataset = dataset.shuffle(
+            shuffle_buffer or len(indices),
+            seed=seed,
+            reshuffle_each_iteration=True
+        )
+
+    # Deterministic order keeps predictions aligned with y[indices]
+    dataset = dataset.batch(batch_size).map(
+        gather_batch,
+        num_parallel_calls=num_parallel_calls,
+        deterministic=True
+    )
+
+    if cache is not None:
+        dataset = dataset.cache(cache)
+
+        if shuffle:
+            n_batches = -(-len(indices) // batch_size)
+            dataset = dataset.shuffle(n_batches, seed=seed, reshuffle_each_iteration=True)
+
+    return dataset.prefetch(tf.data.AUTOTUNE)
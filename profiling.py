@@ -0,0 +1,189 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+import tensorflow as tf
+
+
+# =====================================
+# Stage Profiler
+# =====================================
+
+def peak_rss_mb():
+    """
+    High-water mark of this process's resident memory, in MB, since the
+    process started or since the last reset_peak_rss.
+    """
+    # VmHWM follows reset_peak_rss; ru_maxrss may keep older peaks of
+    # exited threads
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+
+    return peak / 2**10
+
+
+def reset_peak_rss():
+    """
+    Resets the high-water mark of peak_rss_mb to the current resident
+    memory. Only Linux supports this.
+
+    Returns:
+        bool: Whether the mark was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _cpu_seconds():
+    # Includes finished child processes, e.g. parallel file decoding
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageProfiler:
+    """
+    Records wall time, CPU time and peak RSS per pipeline stage, and the
+    training throughput per epoch.
+
+    Stages may be nested; each is recorded under its own name. On Linux the
+    high-water mark is reset when a stage starts, so a stage's peak RSS is
+    the peak reached during that stage (including its nested stages).
+    Elsewhere it is the process high-water mark at the end of the stage,
+    which also covers everything that ran before it.
+    """
+
+    def __init__(self, cprofile=False):
+        self.stages = {}
+        self.epochs = []
+        self._cprofile = cProfile.Profile() if cprofile else None
+
+        # Peaks seen so far by each open stage, outermost first
+        self._open_peaks = []
+        self._peak_mb = 0.0
+
+    def _observe_peak(self):
+        # Every reset loses the mark, so it is first credited to all the
+        # open stages and to the whole run
+        peak = peak_rss_mb()
+        self._open_peaks = [max(open_peak, peak) for open_peak in self._open_peaks]
+        self._peak_mb = max(self._peak_mb, peak)
+        return peak
+
+    @contextmanager
+    def stage(self, name):
+        self._observe_peak()
+        reset_peak_rss()
+        self._open_peaks.append(0.0)
+
+        wall = time.perf_counter()
+        cpu = _cpu_seconds()
+
+        try:
+            yield
+        finally:
+            self._observe_peak()
+
+            self.stages[name] = {
+                "wall_s": time.perf_counter() - wall,
+                "cpu_s": _cpu_seconds() - cpu,
+                "peak_rss_mb": self._open_peaks.pop()
+            }
+
+    def peak_rss_mb(self):
+        """
+        High-water mark of resident memory over the whole run, in MB.
+        """
+        return max(self._peak_mb, peak_rss_mb())
+
+    def callback(self, n_samples):
+        """
+        Keras callback recording seconds and samples/sec of every epoch.
+        """
+        return ThroughputCallback(n_samples, self.epochs)
+
+    def start(self):
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+
+    def samples_per_sec(self):
+        # The first epoch includes graph tracing, so it is skipped when
+        # there are others to average
+        epochs = self.epochs[1:] or self.epochs
+
+        if not epochs:
+            return None
+
+        return float(np.mean([epoch["samples_per_sec"] for epoch in epochs]))
+
+    def save(self, result_dir, config=None, model=None):
+        """
+        Writes ``stages.json`` and, with cProfile enabled, ``profile.prof``
+        (readable with ``python -m pstats`` or snakeviz) to ``result_dir``.
+        ``model`` is an optional model.model_report of the trained model.
+        """
+        with open(os.path.join(result_dir, "stages.json"), "w") as file:
+            json.dump({
+                "config": config,
+                "model": model,
+                "stages": self.stages,
+                "epochs": self.epochs,
+                "samples_per_sec": self.samples_per_sec(),
+                "peak_rss_mb": self.peak_rss_mb()
+            }, file, indent=2)
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(os.path.join(result_dir, "profile.prof"))
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """
+    Times the training part of each epoch; validation, which Keras runs
+    before on_epoch_end, is recorded separately.
+    """
+
+    def __init__(self, n_samples, records):
+        super().__init__()
+        self.n_samples = n_samples
+        self.records = records
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._train_seconds = None
+
+    def on_test_begin(self, logs=None):
+        if self._train_seconds is None:
+            self._train_seconds = time.perf_counter() - self._start
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self._start
+        train_seconds = self._train_seconds or seconds
+
+        self.records.append({
+            "epoch": epoch + 1,
+            "seconds": seconds,
+            "train_seconds": train_seconds,
+            "samples_per_sec": self.n_samples / train_seconds
+        })
@@ -0,0 +1,238 @@
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+from inference import Predictor
+
+
+# =====================================
+# Dynamic Micro-Batching
+# =====================================
+
+class MicroBatcher:
+    """
+    Groups concurrent requests into micro-batches for one Predictor.
+
+    A batch is closed when it holds ``max_batch_size`` trials or when
+    ``max_wait_ms`` has passed since its first request, whichever comes
+    first. All trials of a batch share one feature pass and one model call.
+    """
+
+    def __init__(self, predictor, max_batch_size=32, max_wait_ms=5.0, history=10000):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=history)
+        self._batch_sizes = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, eeg_data):
+        """
+        Queues (trials, channels, samples) EEG and returns a Future holding
+        the Predictor.predict_trials output for those trials. EEG the model
+        cannot take fails this Future right away, never the whole batch.
+        """
+        future = Future()
+        eeg_data = np.asarray(eeg_data)
+
+        try:
+            self.predictor.check_input(eeg_data)
+        except ValueError as error:
+            future.set_exception(error)
+            return future
+
+        self._queue.put((eeg_data, time.perf_counter(), future))
+        return future
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            batch_sizes = np.array(self._batch_sizes)
+
+        if len(latencies) == 0:
+            return {"requests": 0}
+
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+        return {
+            "requests": int(len(latencies)),
+            "latency_ms": {
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(latencies.max())
+            },
+            "mean_batch_trials": float(batch_sizes.mean())
+        }
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        n_trials = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+
+        while n_trials < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            batch.append(request)
+            n_trials += len(request[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            groups = {}
+
+            # Only trials of the same shape can share a feature pass
+            for request in self._collect():
+                groups.setdefault(request[0].shape[1:], []).append(request)
+
+            for batch in groups.values():
+                self._predict(batch)
+
+    def _predict(self, batch):
+        try:
+            eeg_data = np.concatenate([request[0] for request in batch])
+            result = self.predictor.predict_trials(eeg_data)
+        except Exception as error:
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+
+        done = time.perf_counter()
+        start = 0
+
+        for eeg, arrived, future in batch:
+            stop = start + len(eeg)
+            future.set_result({key: value[start:stop] for key, value in result.items()})
+            start = stop
+
+            with self._lock:
+                self._latencies.append(done - arrived)
+
+        with self._lock:
+            self._batch_sizes.append(len(eeg_data))
+
+
+# =====================================
+# HTTP Server
+# =====================================
+
+def _read_eeg(handler):
+    length = int(handler.headers.get("Content-Length", 0))
+    body = handler.rfile.read(length)
+
+    # Binary .npy bodies avoid JSON parsing of large arrays
+    if handler.headers.get("Content-Type") == "application/x-npy":
+        eeg_data = np.load(io.BytesIO(body), allow_pickle=False)
+    else:
+        eeg_data = np.array(json.loads(body)["eeg"], dtype=np.float64)
+
+    # A single (channels, samples) trial
+    if eeg_data.ndim == 2:
+        eeg_data = eeg_data[None]
+
+    return eeg_data
+
+
+def make_handler(batcher):
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            arrived = time.perf_counter()
+
+            try:
+                eeg_data = _read_eeg(self)
+                result = batcher.submit(eeg_data).result()
+            except Exception as error:
+                self._send_json(400, {"error": str(error)})
+                return
+
+            self._send_json(200, {
+                "trial_pred": result["trial_pred"].tolist(),
+                "trial_vote": result["trial_vote"].tolist(),
+                "trial_probs": result["trial_probs"].tolist(),
+                "latency_ms": (time.perf_counter() - arrived) * 1000
+            })
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, batcher.stats())
+            else:
+                self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+        def log_message(self, format, *args):
+            # Per-request logging would dominate latency under load
+            pass
+
+    return PredictionHandler
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Serve a trained checkpoint over HTTP with dynamic batching"
+    )
+
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max_batch_size', type=int, default=32,
+                        help='Maximum trials per micro-batch')
+    parser.add_argument('--max_wait_ms', type=float, default=5.0,
+                        help='Maximum time a request waits for its batch to fill')
+    parser.add_argument('--batch_size', type=int, default=1024,
+                        help='Model batch size (windows) inside a micro-batch')
+
+    args = parser.parse_args()
+
+    predictor = Predictor(
+        args.checkpoint,
+        feature_type=args.feature_type,
+        batch_size=args.batch_size
+    )
+    batcher = MicroBatcher(predictor, args.max_batch_size, args.max_wait_ms)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(batcher))
+    print(f"Serving {args.checkpoint} on http://{args.host}:{args.port} (POST /predict, GET /stats)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
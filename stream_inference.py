@@ -0,0 +1,213 @@
+import argparse
+import time
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+from scipy.signal import spectrogram
+
+from feature_creation import FS, NPERSEG, NOVERLAP, SIS_GATHER_INDEX
+from inference import read_recording
+
+
+# =====================================
+# Incremental STFT
+# =====================================
+
+class IncrementalSpectrogram:
+    """
+    Per-channel ring buffer that emits only the new STFT columns.
+
+    Columns use the same parameters as feature_creation (fs=250,
+    nperseg=125, noverlap=62) and the same frame grid, so the last ``t``
+    columns equal the offline spectrogram of the matching signal segment.
+    """
+
+    def __init__(self, n_channels, capacity=NPERSEG + 16 * (NPERSEG - NOVERLAP)):
+        self.hop = NPERSEG - NOVERLAP
+        self.capacity = capacity
+
+        self._ring = np.zeros((n_channels, capacity))
+        self._received = 0
+        self._next_frame = 0
+
+    def push(self, chunk):
+        """
+        Appends (channels, samples) EEG and returns the completed STFT
+        columns as (channels, f, new_columns); new_columns may be 0.
+        """
+        chunk = np.asarray(chunk)
+        columns = [self._empty_columns()]
+
+        # Never write more than the ring can hold next to an unfinished frame
+        step = self.capacity - NPERSEG
+
+        for start in range(0, chunk.shape[1], step):
+            self._write(chunk[:, start:start + step])
+            columns.append(self._new_columns())
+
+        return np.concatenate(columns, axis=-1)
+
+    def _empty_columns(self):
+        return np.zeros((self._ring.shape[0], NPERSEG // 2 + 1, 0))
+
+    def _write(self, samples):
+        positions = (self._received + np.arange(samples.shape[1])) % self.capacity
+        self._ring[:, positions] = samples
+        self._received += samples.shape[1]
+
+    def _new_columns(self):
+        n_frames = (self._received - self._next_frame - NPERSEG) // self.hop + 1
+
+        if n_frames <= 0:
+            return self._empty_columns()
+
+        # One STFT call covers every frame completed by this write
+        length = (n_frames - 1) * self.hop + NPERSEG
+        positions = (self._next_frame + np.arange(length)) % self.capacity
+
+        _, _, Sxx = spectrogram(
+            self._ring[:, positions],
+            FS,
+            nperseg=NPERSEG,
+            noverlap=NOVERLAP,
+            mode='psd',
+            axis=-1
+        )
+
+        self._next_frame += n_frames * self.hop
+
+        return Sxx
+
+
+# =====================================
+# Streaming Predictor
+# =====================================
+
+class StreamingPredictor:
+    """
+    Consumes continuous EEG in small chunks and emits trial-level predictions.
+
+    Each new STFT column is gathered straight into the (windows, f, t, c)
+    feature tensor, which is kept as a ring along the time axis. A prediction
+    runs once ``t`` columns are available and then every ``emit_every``
+    columns.
+    """
+
+    def __init__(self, model, feature_type="SIS", n_channels=128, emit_every=1):
+        self.model = load_model(model) if isinstance(model, str) else model
+        self.feature_type = feature_type.upper()
+        self.emit_every = emit_every
+
+        f_size, self.t_size, n_inputs = self.model.input_shape[1:]
+
+        if self.feature_type == "SIS":
+            self.gather_index = SIS_GATHER_INDEX
+        else:
+            self.gather_index = np.arange(n_channels)
+
+        n_windows = len(self.gather_index) // n_inputs
+
+        self.stft = IncrementalSpectrogram(n_channels)
+        self.features = np.zeros((n_windows, f_size, self.t_size, n_inputs), dtype=np.float32)
+        self.n_columns = 0
+
+        self._predict = tf.function(
+            lambda x: self.model(x, training=False),
+            reduce_retracing=True
+        )
+        self._predict(self.features)
+
+    def push(self, chunk):
+        """
+        Args:
+            chunk (np.ndarray): (channels, samples) new EEG
+
+        Returns:
+            list: One dict per emitted prediction with ``column``,
+            ``trial_probs``, ``window_probs`` and ``latency`` (seconds since
+            the chunk arrived)
+        """
+        arrived = time.perf_counter()
+        columns = self.stft.push(chunk)
+
+        emitted = []
+        n_inputs = self.features.shape[-1]
+
+        for k in range(columns.shape[-1]):
+            window_cols = columns[self.gather_index, :, k].reshape(
+                len(self.features), n_inputs, -1
+            )
+
+            slot = self.n_columns % self.t_size
+            self.features[:, :, slot, :] = np.moveaxis(window_cols, 1, -1) / 255.0
+            self.n_columns += 1
+
+            ready = self.n_columns >= self.t_size
+            if ready and (self.n_columns - self.t_size) % self.emit_every == 0:
+                emitted.append(self._emit(arrived))
+
+        return emitted
+
+    def current_features(self):
+        # Oldest column first, as in the offline spectrogram
+        shift = -(self.n_columns % self.t_size)
+        return np.roll(self.features, shift, axis=2)
+
+    def _emit(self, arrived):
+        window_probs = self._predict(self.current_features()).numpy()
+
+        return {
+            "column": self.n_columns,
+            "window_probs": window_probs,
+            "trial_probs": window_probs.mean(axis=0),
+            "latency": time.perf_counter() - arrived
+        }
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Replay a recording through the streaming predictor"
+    )
+
+    parser.add_argument('--checkpoint', required=True)
+    parser.add_argument('--feature_type', choices=['SIS', 'WSIS'], required=True)
+    parser.add_argument('--input', required=True, help='.mat (DENS) or .dat (DEAP) recording')
+    parser.add_argument('--chunk', type=int, default=25, help='Samples per pushed chunk')
+    parser.add_argument('--emit_every', type=int, default=1, help='STFT columns between predictions')
+    parser.add_argument('--realtime', action='store_true', help='Pace the replay at the sampling rate')
+
+    args = parser.parse_args()
+
+    eeg_data = read_recording(args.input)[0]
+
+    predictor = StreamingPredictor(
+        args.checkpoint,
+        feature_type=args.feature_type,
+        n_channels=eeg_data.shape[0],
+        emit_every=args.emit_every
+    )
+
+    latencies = []
+    start = time.perf_counter()
+
+    for offset in range(0, eeg_data.shape[1], args.chunk):
+        for result in predictor.push(eeg_data[:, offset:offset + args.chunk]):
+            latencies.append(result["latency"])
+            print(f"column {result['column']}\tpred {np.argmax(result['trial_probs'])}")
+
+        if args.realtime:
+            time.sleep(max(0.0, (offset + args.chunk) / FS - (time.perf_counter() - start)))
+
+    elapsed = time.perf_counter() - start
+    duration = eeg_data.shape[1] / FS
+
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        print(f"Latency ms: p50={p50:.2f} p95={p95:.2f} p99={p99:.2f}")
+
+    print(f"Replayed {duration:.1f}s of EEG in {elapsed:.2f}s ({duration / elapsed:.1f}x real time)")
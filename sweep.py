@@ -0,0 +1,192 @@
+import argparse
+import itertools
+import os
+import time
+
+from datasets.utils import LabelMapper
+from feature_cache import CACHE_DIR, prepare_features
+from workers import run_main, worker_pool
+
+
+SWEEP_LOG_DIR = os.path.join("results", "sweep")
+
+
+# =====================================
+# Grid
+# =====================================
+
+def expand_grid(datasets, tasks, num_classes, feature_types, archs=("cnn_lstm",)):
+    """
+    Returns the valid (dataset, feature_type, task, num_classes, arch)
+    configs of a grid. Task / class combinations LabelMapper rejects are
+    skipped, as is SIS outside DENS (its windows follow the DENS electrode
+    layout).
+    """
+    configs = []
+
+    for dataset, feature_type, task, n, arch in itertools.product(
+        datasets, feature_types, tasks, num_classes, archs
+    ):
+        try:
+            LabelMapper(mode=task, num_classes=n)
+        except ValueError:
+            continue
+
+        if feature_type == "SIS" and dataset != "DENS":
+            continue
+
+        configs.append((dataset, feature_type, task, n, arch))
+
+    return configs
+
+
+def prepare_sweep(configs, cache_dir, chunk_size, dtype, num_workers):
+    """
+    Fills the feature cache for every config before training starts.
+
+    Each dataset is decoded once; its feature tensors are shared by all
+    tasks and the workers only memory-map them. A dataset that fails does
+    not stop the others.
+
+    Returns:
+        dict: {dataset: error} of the datasets that could not be prepared
+    """
+    failed = {}
+
+    for dataset in sorted({config[0] for config in configs}):
+        feature_types = sorted({c[1] for c in configs if c[0] == dataset})
+        label_mappers = [
+            LabelMapper(mode=task, num_classes=n)
+            for task, n in sorted({(c[2], c[3]) for c in configs if c[0] == dataset})
+        ]
+
+        print(f"Preparing {dataset}: {feature_types}, {len(label_mappers)} label mappings")
+
+        try:
+            prepare_features(
+                dataset,
+                label_mappers,
+                feature_types,
+                cache_dir=cache_dir,
+                chunk_size=chunk_size,
+                dtype=dtype,
+                num_workers=num_workers
+            )
+        except Exception as exception:
+            failed[dataset] = repr(exception)
+            print(f"Preparing {dataset} failed, skipping its configs: {failed[dataset]}")
+
+    return failed
+
+
+# =====================================
+# Workers
+# =====================================
+
+def run_sweep(configs, extra_args=(), workers=1, threads_per_worker=None):
+    """
+    Trains every config with main.main in a workers.worker_pool, one
+    fresh process per config.
+
+    Returns:
+        list: (config, test_acc, error, seconds) in completion order
+    """
+    from main import build_parser, init_experiment_log
+
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    init_experiment_log()
+    os.makedirs(SWEEP_LOG_DIR, exist_ok=True)
+
+    jobs = []
+    for config in configs:
+        dataset, feature_type, task, n, arch = config
+        argv = [
+            "--dataset_name", dataset,
+            "--feature_type", feature_type,
+            "--task", task,
+            "--num_classes", str(n),
+            "--arch", arch
+        ]
+        log_path = os.path.join(SWEEP_LOG_DIR, "_".join(map(str, config)) + ".log")
+
+        jobs.append(
+            (config, build_parser().parse_args(argv + list(extra_args)), log_path, None)
+        )
+
+    results = []
+
+    with worker_pool(workers, threads_per_worker) as pool:
+
+        for result in pool.imap_unordered(run_main, jobs):
+            config, test_acc, error, seconds = result
+            status = f"acc={test_acc:.4f}" if error is None else f"FAILED {error}"
+            print(f"{' '.join(map(str, config))}\t{status}\t{seconds:.0f}s")
+
+            results.append(result)
+
+    return results
+
+
+# =====================================
+# Entry Point
+# =====================================
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Run main.py over a grid of configs in parallel. "
+                    "Unknown arguments are passed on to every run."
+    )
+
+    parser.add_argument('--datasets', nargs='+', choices=['DEAP', 'DENS'], default=['DENS'])
+    parser.add_argument('--feature_types', nargs='+', choices=['SIS', 'WSIS'], default=['SIS', 'WSIS'])
+    parser.add_argument('--tasks', nargs='+', choices=['A', 'V', 'VAD'], default=['A', 'V', 'VAD'])
+    parser.add_argument('--num_classes', nargs='+', type=int, default=[2, 3, 8])
+    parser.add_argument('--archs', nargs='+', default=['cnn_lstm'],
+                        help='Architectures from model.ARCHITECTURES')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Configs trained concurrently')
+    parser.add_argument('--threads_per_worker', type=int, default=None,
+                        help='TensorFlow / BLAS threads per run (default: cores / workers)')
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    parser.add_argument('--chunk_size', type=int, default=32)
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--num_workers', type=int, default=1,
+                        help='Processes decoding raw dataset files while preparing the cache')
+    parser.add_argument('--in_memory', action='store_true',
+                        help='Copy the features into RAM in every run instead of sharing the memory-mapped cache')
+
+    args, extra_args = parser.parse_known_args()
+
+    configs = expand_grid(
+        args.datasets, args.tasks, args.num_classes, args.feature_types, args.archs
+    )
+    print(f"{len(configs)} configs, {args.workers} concurrent")
+
+    start = time.perf_counter()
+    failed_datasets = prepare_sweep(
+        configs, args.cache_dir, args.chunk_size, args.dtype, args.num_workers
+    )
+
+    # Configs of unprepared datasets count as failed runs
+    results = [
+        (config, None, f"preparing {config[0]} failed: {failed_datasets[config[0]]}", 0.0)
+        for config in configs if config[0] in failed_datasets
+    ]
+    configs = [config for config in configs if config[0] not in failed_datasets]
+
+    extra_args += [
+        "--cache_dir", args.cache_dir,
+        "--chunk_size", str(args.chunk_size),
+        "--dtype", args.dtype
+    ]
+    if not args.in_memory:
+        extra_args.append("--stream")
+
+    results += run_sweep(configs, extra_args, args.workers, args.threads_per_worker)
+
+    failed = [result for result in results if result[2] is not None]
+    print(f"Finished {len(results) - len(failed)}/{len(results)} configs "
+          f"in {time.perf_counter() - start:.0f}s; logs in {SWEEP_LOG_DIR}")
@@ -0,0 +1,113 @@
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "TF_NUM_INTRAOP_THREADS"
+)
+
+
+# =====================================
+# Process Setup
+# =====================================
+
+@contextmanager
+def limit_threads(threads):
+    """
+    Caps the TensorFlow / BLAS thread pools through the environment while
+    the context is open. Only takes effect in processes that load numpy and
+    TensorFlow afterwards, i.e. in children spawned inside the context; the
+    previous values are restored on exit.
+    """
+    limits = {name: str(threads) for name in THREAD_ENV_VARS}
+    limits["TF_NUM_INTEROP_THREADS"] = str(min(2, threads))
+
+    if "TF_CPP_MIN_LOG_LEVEL" not in os.environ:
+        limits["TF_CPP_MIN_LOG_LEVEL"] = "2"
+
+    previous = {name: os.environ.get(name) for name in limits}
+    os.environ.update(limits)
+
+    try:
+        yield
+
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def redirect_output(log_path):
+    """
+    Sends this process's stdout and stderr to ``log_path``.
+    """
+    # Interleaved Keras progress bars are unreadable, so each run writes
+    # its own log (file descriptors, to catch TensorFlow's C++ output too)
+    with open(log_path, "w") as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+
+
+# =====================================
+# Pool
+# =====================================
+
+@contextmanager
+def worker_pool(processes, threads):
+    """
+    Pool of fresh processes, one task each (maxtasksperchild=1), so Keras
+    layer names and TensorFlow thread settings never leak between runs.
+    Each process is limited to ``threads`` TensorFlow / BLAS threads; the
+    calling process keeps its own settings.
+    """
+    # Spawned children inherit the environment, so the limits are in place
+    # before the re-imported __main__ module loads numpy and TensorFlow
+    # there (too early for a pool initializer). They stay set while the
+    # pool is open, as it replaces every finished worker. Forking a process
+    # that already initialised TensorFlow is unsafe.
+    context = multiprocessing.get_context("spawn")
+
+    with limit_threads(threads), context.Pool(processes=processes, maxtasksperchild=1) as pool:
+        yield pool
+
+
+def run_main(job):
+    """
+    Pool task training one run with main.main.
+
+    Args:
+        job (tuple): (key, args, log_path, environ). ``key`` identifies the
+            run in the result, ``args`` is main's argparse namespace, output
+            goes to ``log_path`` unless it is None, and ``environ`` holds
+            extra environment variables (or None).
+
+    Returns:
+        tuple: (key, test_acc, error, seconds), with the repr of the
+        exception as ``error`` if the run failed, else None
+    """
+    key, args, log_path, environ = job
+
+    os.environ.update(environ or {})
+
+    if log_path is not None:
+        redirect_output(log_path)
+
+    start = time.perf_counter()
+
+    try:
+        from main import main
+        test_acc = main(args)
+        error = None
+    except Exception as exception:
+        test_acc = None
+        error = repr(exception)
+
+    return key, test_acc, error, time.perf_counter() - start